@@ -5,8 +5,9 @@ import time
 import json
 import random
 import inspect
+import threading
 import requests
-from collections import deque, defaultdict
+from collections import deque
 from firebase_admin import firestore
 from datetime import datetime, timezone
 
@@ -26,7 +27,11 @@ from telegram.ext import Updater, CommandHandler, CallbackContext, MessageHandle
 # {setup.py} - Setup commands and functions
 # {admin.py} - Admin commands and functions for group management
 # {auth.py} - User authentication and verification functions
-from modules import config, utils, firebase, logger, brain, crypto, setup, admin, auth
+# {repository.py} - Write-through access to group documents
+# {moderation.py} - Compiled blocklist and allowlist matchers
+# {outbound.py} - Rate shaped outbound message queue
+from modules import config, utils, firebase, logger, brain, crypto, setup, admin, auth, repository, moderation
+from modules.outbound import outbound
 #
 ## This is the public version of the bot that was developed by Tukyo for the Sypher project.
 ## This bot has a customizable commands feature and admin controls, along with full charting, price, and buybot functionality.
@@ -81,35 +86,66 @@ from modules import config, utils, firebase, logger, brain, crypto, setup, admin
 ##
 
 #region Classes
+class SpamRecord: # Recent message times and mute deadline for one (user_id, chat_id)
+    __slots__ = ('message_times', 'blocked_until')
+
+    def __init__(self, rate_limit):
+        self.message_times = deque(maxlen=rate_limit + 1) # Only the newest rate_limit + 1 messages can decide a block
+        self.blocked_until = 0
+
 class AntiSpam:
-    def __init__(self, rate_limit, time_window, mute_duration): # Check if a user is spamming, if they are mute them for a set duration
+    def __init__(self, rate_limit, time_window, mute_duration, sweep_interval=60): # Check if a user is spamming, if they are mute them for a set duration
         self.rate_limit = rate_limit
         self.time_window = time_window
         self.mute_duration = mute_duration
-        self.user_messages = defaultdict(list)
-        self.blocked_users = defaultdict(lambda: 0)
+        self.sweep_interval = sweep_interval
+        self.records = {} # (user_id, chat_id) -> SpamRecord, only for users active within the window or still muted
+        self.next_sweep = time.time() + sweep_interval
+        self.lock = threading.Lock()
         print(f"Initialized AntiSpam with rate_limit={rate_limit}, time_window={time_window}, mute_duration={mute_duration}")
 
     def is_spam(self, user_id, chat_id):
         current_time = time.time()
         key = (user_id, chat_id)
 
-        # Check if user is still muted
-        if current_time < self.blocked_users[key]:
-            print(f"User {user_id} in chat {chat_id} is muted until {self.blocked_users[key]} (current time: {current_time})")
-            return True
-        
-        # Clean up old messages and add the new one
-        self.user_messages[key] = [msg_time for msg_time in self.user_messages[key] if current_time - msg_time < self.time_window]
-        self.user_messages[key].append(current_time)
-        
-        # Check if user exceeds rate limit
-        if len(self.user_messages[key]) > self.rate_limit:
-            self.blocked_users[key] = current_time + self.mute_duration
-            print(f"User {user_id} in chat {chat_id} is blocked until {self.blocked_users[key]} (block duration: {self.mute_duration} seconds)")
-            return True
-        
-        return False
+        with self.lock:
+            if current_time >= self.next_sweep:
+                self.sweep(current_time)
+
+            record = self.records.get(key)
+            if record is None:
+                record = self.records[key] = SpamRecord(self.rate_limit)
+
+            # Check if user is still muted
+            if current_time < record.blocked_until:
+                print(f"User {user_id} in chat {chat_id} is muted until {record.blocked_until} (current time: {current_time})")
+                return True
+
+            # Clean up old messages and add the new one
+            message_times = record.message_times
+            while message_times and current_time - message_times[0] >= self.time_window:
+                message_times.popleft()
+            message_times.append(current_time)
+
+            # Check if user exceeds rate limit
+            if len(message_times) > self.rate_limit:
+                record.blocked_until = current_time + self.mute_duration
+                print(f"User {user_id} in chat {chat_id} is blocked until {record.blocked_until} (block duration: {self.mute_duration} seconds)")
+                return True
+
+            return False
+
+    def sweep(self, current_time): # Drop users with no message in the window and no active mute, caller must hold the lock
+        idle_keys = [
+            key for key, record in self.records.items()
+            if current_time >= record.blocked_until
+            and (not record.message_times or current_time - record.message_times[-1] >= self.time_window)
+        ]
+        for key in idle_keys:
+            del self.records[key]
+
+        self.next_sweep = current_time + self.sweep_interval
+        print(f"AntiSpam sweep removed {len(idle_keys)} idle users, tracking {len(self.records)}.")
 
 class AntiRaid:
     def __init__(self, user_amount, time_out, anti_raid_time):
@@ -126,7 +162,7 @@ class AntiRaid:
             return True
 
         self.join_times.append(current_time)
-        print(f"User joined at time {current_time}. Join times: {list(self.join_times)}")
+        print(f"User joined at time {current_time}. Joins in window: {len(self.join_times)}")
         while self.join_times and current_time - self.join_times[0] > self.time_out:
             self.join_times.popleft()
 
@@ -144,6 +180,50 @@ class AntiRaid:
         if current_time < self.anti_raid_end_time:
             return int(self.anti_raid_end_time - current_time)
         return 0
+
+    def is_idle(self, current_time): # No lockdown running and every recorded join has left the window
+        return (
+            current_time >= self.anti_raid_end_time
+            and (not self.join_times or current_time - self.join_times[-1] > self.time_out)
+        )
+
+class AntiRaidRegistry: # One AntiRaid per chat so a raid in one group never locks down another
+    def __init__(self, user_amount, time_out, anti_raid_time, sweep_interval=300):
+        self.user_amount = user_amount
+        self.time_out = time_out
+        self.anti_raid_time = anti_raid_time
+        self.sweep_interval = sweep_interval
+        self.chats = {} # chat_id -> AntiRaid, dropped again once idle
+        self.next_sweep = time.time() + sweep_interval
+        self.lock = threading.Lock()
+
+    def get(self, chat_id, group_data=None): # Thresholds come from admin.anti_raid in the group settings, falling back to the defaults
+        settings = (group_data or {}).get('admin', {}).get('anti_raid', {})
+        user_amount = settings.get('user_amount', self.user_amount)
+        time_out = settings.get('time_out', self.time_out)
+        anti_raid_time = settings.get('lockdown_time', self.anti_raid_time)
+
+        current_time = time.time()
+        with self.lock:
+            if current_time >= self.next_sweep:
+                self.sweep(current_time)
+
+            anti_raid = self.chats.get(chat_id)
+            if anti_raid is None:
+                anti_raid = self.chats[chat_id] = AntiRaid(user_amount=user_amount, time_out=time_out, anti_raid_time=anti_raid_time)
+            else: # Pick up changed settings without losing the current window
+                anti_raid.user_amount = user_amount
+                anti_raid.time_out = time_out
+                anti_raid.anti_raid_time = anti_raid_time
+            return anti_raid
+
+    def sweep(self, current_time): # Caller must hold the lock
+        idle_chats = [chat_id for chat_id, anti_raid in self.chats.items() if anti_raid.is_idle(current_time)]
+        for chat_id in idle_chats:
+            del self.chats[chat_id]
+
+        self.next_sweep = current_time + self.sweep_interval
+        print(f"AntiRaid sweep removed {len(idle_chats)} idle chats, tracking {len(self.chats)}.")
 #endregion Classes
 
 ANTI_SPAM_RATE_LIMIT = 5
@@ -154,7 +234,7 @@ ANTI_RAID_TIME_OUT = 10
 ANTI_RAID_LOCKDOWN_TIME = 180
 
 anti_spam = AntiSpam(rate_limit=ANTI_SPAM_RATE_LIMIT, time_window=ANTI_SPAM_TIME_WINDOW, mute_duration=ANTI_SPAM_MUTE_DURATION)
-anti_raid = AntiRaid(user_amount=ANTI_RAID_USER_AMOUNT, time_out=ANTI_RAID_TIME_OUT, anti_raid_time=ANTI_RAID_LOCKDOWN_TIME)
+anti_raids = AntiRaidRegistry(user_amount=ANTI_RAID_USER_AMOUNT, time_out=ANTI_RAID_TIME_OUT, anti_raid_time=ANTI_RAID_LOCKDOWN_TIME)
 
 sys.stdout = logger.StdoutWrapper()  # Redirect stdout
 sys.stderr = logger.StderrWrapper()  # Redirect stderr
@@ -190,8 +270,7 @@ def bot_added_to_group(update: Update, context: CallbackContext) -> None:
         owner_username = inviter.username
         print(f"Adding group {group_id} to database with owner {owner_id} ({owner_username})")
         chat_id = update.effective_chat.id
-        group_doc = firebase.DATABASE.collection('groups').document(str(chat_id))
-        group_doc.set({
+        repository.groups.set(chat_id, {
             'group_id': group_id,
             'owner_id': owner_id,
             'owner_username': owner_username,
@@ -220,7 +299,6 @@ def bot_added_to_group(update: Update, context: CallbackContext) -> None:
                 'volume': True
             }
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         print(f"Group {group_id} added to database.")
 
@@ -268,8 +346,8 @@ def bot_removed_from_group(update: Update, context: CallbackContext) -> None:
         print(f"Removing group {update.effective_chat.id} from database.")
         group_counter = firebase.DATABASE.collection('stats').document('removedgroups')
         group_counter = group_counter.update({'count': firestore.Increment(1)}) # Get the current removed groups count and increment by 1
-        group_doc.delete()  # Directly delete the group document
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+        repository.groups.delete(update.effective_chat.id)  # Delete the group document and its cache entry
+        crypto.unschedule_group_monitoring(str(update.effective_chat.id)) # Stop buy alerts for the group
 
 def start(update: Update, context: CallbackContext) -> None:
     msg = None
@@ -285,12 +363,9 @@ def start(update: Update, context: CallbackContext) -> None:
             user_id_from_link = command_args[2]
             print(f"Attempting to authenticate user {user_id_from_link} for group {group_id}")
 
-            group_doc = firebase.DATABASE.collection('groups').document(group_id)
-            group_data = group_doc.get()
-            if group_data.exists:
-                unverified_users = group_data.to_dict().get('unverified_users', {})
-                print(f"Unverified users list: {unverified_users}")
-                if str(user_id_from_link) in unverified_users:
+            group_data = utils.fetch_group_info(update, context, group_id=group_id)
+            if group_data:
+                if repository.groups.is_member(group_id, 'unverified_users', user_id_from_link, fresh=True):
 
                     keyboard = [[InlineKeyboardButton("Authenticate", callback_data=f'authenticate_{group_id}_{user_id_from_link}')]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -335,8 +410,8 @@ def handle_new_user(update: Update, context: CallbackContext) -> None:
         group_data.get('premium_features', {}).get('sypher_trust') if group_data else False
     )
 
-    updates = {} # Initialize the updates to send to the database at the end of the function
-        
+    anti_raid = anti_raids.get(group_id, group_data) # This group's raid window and thresholds
+
     for member in update.message.new_chat_members:
             user_id = member.id
             chat_id = update.message.chat.id
@@ -369,7 +444,7 @@ def handle_new_user(update: Update, context: CallbackContext) -> None:
 
             if sypher_trust_enabled:
                 print(f"Sypher Trust is enabled for group {group_id}. Adding user {user_id} to untrusted_users.")
-                updates[f'untrusted_users.{user_id}'] = current_time
+                repository.groups.set_member(chat_id, 'untrusted_users', user_id, current_time, buffered=True) # Coalesced with the rest of the join storm
             
             auth_url = f"https://t.me/{config.BOT_USERNAME}?start=authenticate_{chat_id}_{user_id}"
             keyboard = [ [InlineKeyboardButton("Start Authentication", url=auth_url)] ]
@@ -408,11 +483,11 @@ def handle_new_user(update: Update, context: CallbackContext) -> None:
                 )
                 print(f"Group {group_id} does not have premium features enabled. Sending welcome message without image.")
 
-            updates[f'unverified_users.{user_id}'] = { # Collect updates for Firestore
+            repository.groups.set_member(chat_id, 'unverified_users', user_id, { # Buffered, committed in one batch with the rest of the join storm
                 'timestamp': current_time,
                 'challenge': None,  # Initializes with no challenge
                 'join_message_id': msg.message_id
-            }
+            }, buffered=True)
             print(f"New user {user_id} added to unverified users in group {group_id} at {current_time}")
 
             context.job_queue.run_once( # Schedule the deletion of the join message after 5 minutes
@@ -423,10 +498,6 @@ def handle_new_user(update: Update, context: CallbackContext) -> None:
 
             delete_service_messages(update, context)
 
-            if updates:
-                group_doc.update(updates)
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     if msg is not None:
         utils.track_message(msg)
 
@@ -465,15 +536,17 @@ def handle_message(update: Update, context: CallbackContext) -> None:
 
     print(f"Message sent by user {user_id} in chat {chat_id}")
 
+    scan = moderation.scan_message(msg) # One pass for addresses, links, domains and mentions, reused by every check below
+
     detected_patterns = []
-    if config.ETH_ADDRESS_PATTERN.search(msg):
+    if scan.addresses:
         detected_patterns.append("eth_address")
-    if config.URL_PATTERN.search(msg):
+    if scan.urls:
         detected_patterns.append("url")
-    if config.DOMAIN_PATTERN.search(msg):
+    if scan.domains:
         detected_patterns.append("domain")
 
-    if re.search(r"@\w+", msg): # Trigger trust check
+    if scan.mentions: # Trigger trust check
         print(f"Detected mention in message: {msg}")
         if not utils.is_user_trusted(update, context):
             print(f"User {user_id} is not trusted to tag others.")
@@ -489,7 +562,7 @@ def handle_message(update: Update, context: CallbackContext) -> None:
             print("Allowlist check is disabled in admin settings. Skipping allowlist verification.")
             return
 
-        allowlist = group_data.get('allowlist', [])
+        allowlist = moderation.get_allowlist(chat_id, group_data) or moderation.Allowlist([]) # Set lookups instead of scanning the list
         group_info = group_data.get('group_info', {})
 
         group_website = group_info.get('website_url', None)
@@ -497,13 +570,13 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         for pattern in detected_patterns:
             if pattern == "eth_address":
                 print(f"Detected crypto address in message: {msg}")
-                delete_blocked_addresses(update, context)
+                delete_blocked_addresses(update, context, scan)
                 return
             elif pattern == "url":
-                matched_url = config.URL_PATTERN.search(msg).group()  # Extract the detected URL
+                matched_url = scan.urls[0]  # Extract the detected URL
                 normalized_msg = re.sub(r'^https?://', '', msg).strip().lower().rstrip('/')  # Normalize the URL
                 print(f"Detected URL: {matched_url} - Normalized: {normalized_msg}")
-                delete_blocked_links(update, context)
+                delete_blocked_links(update, context, scan)
                 return
             elif pattern == "domain":
                 def extract_domain(url): # Extract the domain from the group's website_url
@@ -515,14 +588,14 @@ def handle_message(update: Update, context: CallbackContext) -> None:
                     print(f"Domain matches group website: {msg}.")
                     return  # Skip deletion for matching group website domain
                 
-                if not is_allowed(msg, allowlist, config.DOMAIN_PATTERN):
+                if not is_allowed(msg, allowlist, scan.domains):
                     print(f"Blocked domain: {msg}")
                     context.bot.delete_message(chat_id=chat_id, message_id=update.message.message_id)
                     return
 
-    delete_blocked_addresses(update, context)
+    delete_blocked_addresses(update, context, scan)
     delete_blocked_phrases(update, context)
-    delete_blocked_links(update, context)
+    delete_blocked_links(update, context, scan)
     handle_guess(update, context)
     handle_AI_prompt(update, context)
 
@@ -627,40 +700,36 @@ def handle_spam(update: Update, context: CallbackContext, chat_id, user_id, user
     group_data, group_doc = result  # Unpack the tuple
 
     # Only send the message if the user is not in the unverified_users mapping
-    if str(user_id) not in group_data.get('unverified_users', {}):
+    if not repository.groups.is_member(chat_id, 'unverified_users', user_id):
         auth_url = f"https://t.me/{config.BOT_USERNAME}?start=authenticate_{chat_id}_{user_id}"
         keyboard = [
             [InlineKeyboardButton("Remove Restrictions", url=auth_url)]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        context.bot.send_message(
-            chat_id=chat_id,
+        outbound.send( # Queued so a spam wave does not stall the handler threads on flood waits
+            chat_id,
             text=f"@{username}, you have been muted for spamming. Press the button below to re-authenticate.",
             reply_markup=reply_markup
         )
 
         current_time = datetime.now(timezone.utc).isoformat()  # Get the current date/time in ISO 8601 format
         user_data = {
-            str(user_id): {
-                'timestamp': current_time,
-                'challenge': None  # Initializes with no challenge
-            }
+            'timestamp': current_time,
+            'challenge': None  # Initializes with no challenge
         }
-        group_doc.update({'unverified_users': user_data})  # Update the document with structured data
+        repository.groups.set_member(chat_id, 'unverified_users', user_id, user_data)  # Add only this user, keeping the rest of the mapping
         print(f"New user {user_id} added to unverified users in group {group_id} at {current_time}")
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
-def is_allowed(message, allowlist, pattern): # Check if any detected matches in the message are present in the allowlist.
+def is_allowed(message, allowlist, matches): # Check if any detected matches in the message are present in the allowlist.
     print(f"Pattern found, checking message: {message}")
 
-    matches = pattern.findall(message)
     for match in matches:
         if match in allowlist:
             return True
     return False
 
-def delete_blocked_addresses(update: Update, context: CallbackContext):
+def delete_blocked_addresses(update: Update, context: CallbackContext, scan: moderation.ScanResult = None):
     print("Checking message for unallowed addresses...")
     
     message_text = update.message.text
@@ -669,7 +738,8 @@ def delete_blocked_addresses(update: Update, context: CallbackContext):
         print("No text in message.")
         return
 
-    found_addresses = config.ETH_ADDRESS_PATTERN.findall(message_text)
+    scan = scan or moderation.scan_message(message_text)
+    found_addresses = scan.addresses
 
     if not found_addresses:
         print("No addresses found in message.")
@@ -694,7 +764,7 @@ def delete_blocked_addresses(update: Update, context: CallbackContext):
             print("Deleted a message containing unallowed address.")
             break
 
-def delete_blocked_links(update: Update, context: CallbackContext):
+def delete_blocked_links(update: Update, context: CallbackContext, scan: moderation.ScanResult = None):
     print("Checking message for unallowed links...")
     message_text = update.message.text
 
@@ -702,9 +772,10 @@ def delete_blocked_links(update: Update, context: CallbackContext):
         print("No text in message.")
         return
 
-    # Regular expressions to find URLs and domains
-    found_links = config.URL_PATTERN.findall(message_text)
-    found_domains = config.DOMAIN_PATTERN.findall(message_text)
+    # URLs and domains from the message scan, scanned here if the caller didn't pass one
+    scan = scan or moderation.scan_message(message_text)
+    found_links = scan.urls
+    found_domains = scan.domains
 
     if not found_links and not found_domains:
         print("No links or domains found in message.")
@@ -716,27 +787,22 @@ def delete_blocked_links(update: Update, context: CallbackContext):
         print("No group info available.")
         return
 
-    # Directly use the allowlist as an array
-    allowlist_items = group_info.get('allowlist', [])
-    if not isinstance(allowlist_items, list):
-        print("Allowlist is not in the correct format.")
+    # Compiled allowlist trie, rebuilt only when the group's allowlist changes
+    allowlist = moderation.get_allowlist(update.effective_chat.id, group_info)
+    if allowlist is None:
         return
 
-    # Normalize allowlist entries
-    normalized_allowlist = [item.strip().lower().rstrip('/') for item in allowlist_items]
-
     # Combine found links and domains
     found_items = found_links + found_domains
     print(f"Found items: {found_items}")
-    print(f"Normalized allowlist: {normalized_allowlist}")
 
     for item in found_items:
         # Normalize the found item for comparison
-        normalized_item = item.lower().replace('http://', '').replace('https://', '').rstrip('/')
+        normalized_item = moderation.normalize_found_item(item)
         print(f"Checking item: {normalized_item}")
 
         # Check if the item is in the allowlist
-        if not any(normalized_item.startswith(allowed_item) for allowed_item in normalized_allowlist):
+        if not allowlist.allows(normalized_item):
             try:
                 update.message.delete()
                 print(f"Deleted a message with unallowed item: {normalized_item}")
@@ -764,22 +830,14 @@ def delete_blocked_phrases(update: Update, context: CallbackContext):
         print("Blocklist is disabled for this group.")
         return
 
-    blocklist_field = 'blocklist' # Get the blocklist as an array from the group info
-    blocklist_items = group_info.get(blocklist_field, [])
-
-    if not isinstance(blocklist_items, list): # Ensure blocklist_items is a list
-        print("Blocklist is not properly formatted as an array.")
-        return
-
-    for phrase in blocklist_items: # Check each blocked phrase in the group's blocklist
-        if re.search(rf'\b{re.escape(phrase)}\b', message_text): # Use regex
-            print(f"Found blocked phrase: {phrase}")
-            try:
-                update.message.delete()
-                print("Message deleted due to blocked phrase.")
-            except Exception as e:
-                print(f"Error deleting message: {e}")
-            break  # Exit loop after deleting the message to prevent multiple deletions for one message
+    phrase = moderation.find_blocked_phrase(update.effective_chat.id, group_info, message_text) # One pass over the message with the group's compiled blocklist
+    if phrase is not None:
+        print(f"Found blocked phrase: {phrase}")
+        try:
+            update.message.delete()
+            print("Message deleted due to blocked phrase.")
+        except Exception as e:
+            print(f"Error deleting message: {e}")
 
 def delete_service_messages(update, context):
     non_deletable_message_id = context.chat_data.get('non_deletable_message_id')
@@ -990,7 +1048,7 @@ def play(update: Update, context: CallbackContext) -> None:
     msg = None
     chat_id = str(update.effective_chat.id)
 
-    if not utils.rate_limit_check(chat_id):
+    if not utils.rate_limit_check(chat_id, 'play'):
         msg = update.message.reply_text('Bot rate limit exceeded. Please try again later.')
         return
 
@@ -1194,7 +1252,7 @@ def send_rick_video(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
     args = context.args
 
-    if not utils.rate_limit_check(chat_id):
+    if not utils.rate_limit_check(chat_id, 'rick'):
         msg = update.message.reply_text('Bot rate limit exceeded. Please try again later.')
         return
     
@@ -1309,7 +1367,7 @@ def liquidity(update: Update, context: CallbackContext) -> None:
     chat_id = str(update.effective_chat.id)
     group_data = utils.fetch_group_info(update, context)
 
-    if not utils.rate_limit_check(chat_id):
+    if not utils.rate_limit_check(chat_id, 'liquidity'):
         msg = update.message.reply_text('Bot rate limit exceeded. Please try again later.')
         return
     
@@ -1332,7 +1390,7 @@ def liquidity(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("Liquidity address or chain not found for this group.")
         return
 
-    liquidity_usd = get_liquidity(chain, lp_address)
+    liquidity_usd = crypto.call_with_timeout(get_liquidity, chain, lp_address)
     if liquidity_usd:
         msg = update.message.reply_text(f"Liquidity: ${liquidity_usd}")
     else:
@@ -1349,7 +1407,7 @@ def get_liquidity(chain, lp_address):
         if chain_lower == "polygon":
             chain_lower = "polygon_pos"
         url = f"https://api.geckoterminal.com/api/v2/networks/{chain_lower}/pools/{lp_address}"
-        response = requests.get(url)
+        response = requests.get(url, timeout=crypto.PRICE_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         liquidity_usd = data['data']['attributes']['reserve_in_usd']
@@ -1363,7 +1421,7 @@ def volume(update: Update, context: CallbackContext) -> None:
     group_data = utils.fetch_group_info(update, context)
     chat_id = str(update.effective_chat.id)
 
-    if not utils.rate_limit_check(chat_id):
+    if not utils.rate_limit_check(chat_id, 'volume'):
         msg = update.message.reply_text('Bot rate limit exceeded. Please try again later.')
         return
     
@@ -1386,7 +1444,7 @@ def volume(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("Liquidity address or chain not found for this group.")
         return
     
-    volume_24h_usd = get_volume(chain, lp_address)
+    volume_24h_usd = crypto.call_with_timeout(get_volume, chain, lp_address)
     if volume_24h_usd:
         volume_24h_usd = float(volume_24h_usd) # Ensure the value is treated as a float for formatting
         msg = update.message.reply_text(f"24-hour trading volume in USD: ${volume_24h_usd:.4f}")
@@ -1404,7 +1462,7 @@ def get_volume(chain, lp_address):
         if chain_lower == "polygon":
             chain_lower = "polygon_pos"
         url = f"https://api.geckoterminal.com/api/v2/networks/{chain_lower}/pools/{lp_address}"
-        response = requests.get(url)
+        response = requests.get(url, timeout=crypto.PRICE_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         volume_24h_usd = data['data']['attributes']['volume_usd']['h24']
@@ -1441,19 +1499,19 @@ def price(update: Update, context: CallbackContext) -> None:
         return
 
     try:
-        pool_type = crypto.determine_pool_type(chain, lp_address)
+        pool_type = crypto.call_with_timeout(crypto.determine_pool_type, chain, lp_address)
         if pool_type not in ["v3", "v2"]:
             update.message.reply_text("Failed to determine pool type.")
             return
         
         if modifier == "USD":
-            token_price_in_usd = crypto.get_token_price_in_usd(chain, lp_address) # Use the existing get_token_price_in_usd function
+            token_price_in_usd = crypto.fetch_price(chain, lp_address) # Same price service the buybot uses
             if token_price_in_usd is None:
                 update.message.reply_text("Failed to fetch token price in USD.")
                 return
             update.message.reply_text(f"${token_price_in_usd:.9f}")
         elif modifier == "ETH":
-            price_in_weth = crypto.get_uniswap_position_data(chain, lp_address, pool_type)
+            price_in_weth = crypto.call_with_timeout(crypto.get_uniswap_position_data, chain, lp_address, pool_type)
             if price_in_weth is None:
                 print("Failed to fetch Uniswap V3 position data.")
                 update.message.reply_text("Failed to fetch Uniswap V3 position data.")
@@ -1481,7 +1539,7 @@ def chart(update: Update, context: CallbackContext) -> None:
             msg = update.message.reply_text('Invalid time frame specified. Please use /chart with m, h, or d.')
             return
         
-    if not utils.rate_limit_check(chat_id):
+    if not utils.rate_limit_check(chat_id, 'chart'):
         msg = update.message.reply_text('Bot rate limit exceeded. Please try again later.')
         return
     
@@ -1642,6 +1700,7 @@ def main() -> None:
     dispatcher.add_handler(CallbackQueryHandler(setup.setup_minimum_buy_callback, pattern='^setup_minimum_buy'))
     dispatcher.add_handler(CallbackQueryHandler(setup.setup_small_buy_callback, pattern='^setup_small_buy'))
     dispatcher.add_handler(CallbackQueryHandler(setup.setup_medium_buy_callback, pattern='^setup_medium_buy'))
+    dispatcher.add_handler(CallbackQueryHandler(setup.setup_digest_buy_callback, pattern='^setup_digest_buy'))
     #endregion Callbacks
     
     #region Message Handlers
@@ -1679,9 +1738,12 @@ def main() -> None:
 
     brain.initialize_openai()
 
+    outbound.start(updater.bot) # Start delivering queued messages
     updater.start_polling() # Start the Bot
     crypto.start_monitoring_groups() # Start monitoring premium groups
     updater.idle() # Run the bot until stopped
+    outbound.stop() # Drain queued messages before exiting
+    repository.groups.flush() # Commit any buffered writes before exiting
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import sys
+from firebase_admin import firestore
+
+## Import the needed modules from the config folder
+# {firebase.py} - Firebase configuration and database initialization
+# {repository.py} - Group document access and member storage layout
+from modules import firebase, repository
+#
+## One-shot migration from member maps on the group document to per-user subcollection documents.
+## Moves unverified_users, untrusted_users, muted_users and warnings to groups/{group_id}/{field}/{user_id}.
+##
+## Stop the bot, run `python scripts/migrate_members.py` (add --dry-run to only report), then restart the bot
+## with MEMBER_STORAGE=subcollection. Safe to re-run: member documents are written before the map fields are
+## removed, so an interrupted run leaves the data in both places and the next run picks up where it left off.
+#
+
+#region Migration
+def migrate_group(group_snapshot, dry_run: bool) -> int:
+    group_id = group_snapshot.id
+    group_data = group_snapshot.to_dict() or {}
+    group_doc = repository.groups.document(group_id)
+
+    member_writes = []
+    migrated_fields = []
+    for field in repository.MEMBER_FIELDS:
+        if field not in group_data:
+            continue
+        migrated_fields.append(field)
+
+        members = group_data.get(field)
+        if not isinstance(members, dict):
+            print(f"Group {group_id}: {field} is not a map ({type(members).__name__}), dropping it.")
+            continue
+
+        for user_id, value in members.items():
+            member_writes.append((group_doc.collection(field).document(str(user_id)), {'value': value}))
+
+    if not migrated_fields:
+        return 0
+
+    print(f"Group {group_id}: moving {len(member_writes)} member entries from {', '.join(migrated_fields)}.")
+    if dry_run:
+        return len(member_writes)
+
+    for start in range(0, len(member_writes), repository.BATCH_WRITE_LIMIT):
+        batch = firebase.DATABASE.batch()
+        for member_doc, member_data in member_writes[start:start + repository.BATCH_WRITE_LIMIT]:
+            batch.set(member_doc, member_data)
+        batch.commit()
+
+    group_doc.update({field: firestore.DELETE_FIELD for field in migrated_fields}) # Only after every member document landed
+    return len(member_writes)
+
+def migrate_members(dry_run: bool = False) -> None:
+    group_count = 0
+    member_count = 0
+
+    for group_snapshot in firebase.DATABASE.collection('groups').stream():
+        try:
+            migrated = migrate_group(group_snapshot, dry_run)
+        except Exception as e:
+            print(f"Failed to migrate group {group_snapshot.id}: {e}")
+            continue
+
+        if migrated:
+            group_count += 1
+            member_count += migrated
+
+    action = "Would move" if dry_run else "Moved"
+    print(f"{action} {member_count} member entries across {group_count} groups.")
+#endregion Migration
+
+if __name__ == '__main__':
+    firebase.initialize_firebase()
+    migrate_members(dry_run='--dry-run' in sys.argv[1:])
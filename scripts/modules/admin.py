@@ -6,9 +6,9 @@ from telegram.ext import CallbackContext
 ## Import the needed modules from the config folder
 # {config.py} - Environment variables and global variables used in the bot
 # {utils.py} - Utility functions and variables used in the bot
-# {firebase.py} - Firebase configuration and database initialization
 # {setup.py} - Setup and configuration functions for the bot
-from modules import config, utils, firebase, setup
+# {repository.py} - Write-through access to group documents
+from modules import config, utils, setup, repository
 
 from firebase_admin import firestore
 from datetime import datetime
@@ -48,8 +48,7 @@ def mute(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
     if utils.is_user_admin(update, context):
-        group_doc = firebase.DATABASE.collection('groups').document(str(chat_id))
-        group_data = group_doc.get().to_dict()
+        group_data = utils.fetch_group_info(update, context)
 
         if group_data is None or not group_data.get('admin', {}).get('mute', False):
             msg = update.message.reply_text("Muting is not enabled in this group.")
@@ -72,10 +71,7 @@ def mute(update: Update, context: CallbackContext) -> None:
         context.bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=ChatPermissions(can_send_messages=False))
         msg = update.message.reply_text(f"User {username} has been muted.")
 
-        group_doc.update({ # Add the user to the muted_users mapping in the database
-            f'muted_users.{user_id}': datetime.now().isoformat()
-        })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+        repository.groups.set_member(chat_id, 'muted_users', user_id, datetime.now().isoformat()) # Add the user to the muted_users mapping in the database
     else:
         msg = update.message.reply_text("You must be an admin to use this command.")
     
@@ -86,8 +82,7 @@ def unmute(update: Update, context: CallbackContext) -> None:
     msg = None
     chat_id = update.effective_chat.id
 
-    group_doc = firebase.DATABASE.collection('groups').document(str(chat_id))
-    group_data = group_doc.get().to_dict()
+    group_data = utils.fetch_group_info(update, context)
 
     if group_data is None or not group_data.get('admin', {}).get('mute', False):
         msg = update.message.reply_text("Muting is disabled in this group!")
@@ -103,17 +98,14 @@ def unmute(update: Update, context: CallbackContext) -> None:
             return
         username_to_unmute = context.args[0].lstrip('@')
 
-        for user_id in group_data.get('muted_users', {}):
+        for user_id in repository.groups.list_members(chat_id, 'muted_users', group_data):
             try:
                 user_info = context.bot.get_chat_member(chat_id=chat_id, user_id=user_id).user
                 if user_info.username == username_to_unmute:
                     context.bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=ChatPermissions(can_send_messages=True))
                     msg = update.message.reply_text(f"User @{username_to_unmute} has been unmuted.")
 
-                    group_doc.update({ # Remove the user from the muted_users mapping in the database
-                        f'muted_users.{user_id}': firestore.DELETE_FIELD
-                    })
-                    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+                    repository.groups.delete_member(chat_id, 'muted_users', user_id) # Remove the user from the muted_users mapping in the database
                     break
             except Exception:
                 continue
@@ -130,11 +122,13 @@ def check_mute_list(update: Update, context: CallbackContext) -> None:
     group_id = update.effective_chat.id
     group_data = utils.fetch_group_info(update, context)
 
+    muted_users = repository.groups.list_members(group_id, 'muted_users', group_data) if group_data is not None else {}
+
     mute_list_text = '*Current Mute List:*\n\n'
-    if group_data is None or 'muted_users' not in group_data or not group_data['muted_users']:
+    if not muted_users:
         mute_list_text += 'No users are currently muted.'
     else:
-        for user_id, mute_date in group_data['muted_users'].items():
+        for user_id, mute_date in muted_users.items():
             try:
                 user_info = context.bot.get_chat_member(chat_id=group_id, user_id=user_id).user
                 username = user_info.username
@@ -167,8 +161,7 @@ def warn(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
 
     if utils.is_user_admin(update, context):
-        group_doc = firebase.DATABASE.collection('groups').document(str(chat_id))
-        group_data = group_doc.get().to_dict()
+        group_data = utils.fetch_group_info(update, context)
 
         if group_data is None or not group_data.get('admin', {}).get('warn', False): # Check if warns enabled
             msg = update.message.reply_text("Warning system is not enabled in this group.")
@@ -190,22 +183,13 @@ def warn(update: Update, context: CallbackContext):
         if utils.is_bot_or_admin(update, context, user_id): return
         
         try:
-            doc_snapshot = group_doc.get()
-            if doc_snapshot.exists:
-                group_data = doc_snapshot.to_dict()
-                warnings_dict = group_data.get('warnings', {})
+            current_warnings = repository.groups.get_member(chat_id, 'warnings', user_id, default=0) # Increment the warning count for the user
+            current_warnings += 1
 
-                current_warnings = warnings_dict.get(user_id, 0) # Increment the warning count for the user
-                current_warnings += 1
-                warnings_dict[user_id] = current_warnings
+            repository.groups.set_member(chat_id, 'warnings', user_id, current_warnings) # Update only this user's warnings count
+            msg = update.message.reply_text(f"{username} has been warned. Total warnings: {current_warnings}")
 
-                group_doc.update({'warnings': warnings_dict}) # Update the group document with the new warnings count
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-                msg = update.message.reply_text(f"{username} has been warned. Total warnings: {current_warnings}")
-
-                process_warns(update, context, user_id, current_warnings) # Check if the user has reached the warning limit
-            else:
-                msg = update.message.reply_text("Group data not found.")
+            process_warns(update, context, user_id, current_warnings) # Check if the user has reached the warning limit
         except Exception as e:
             msg = update.message.reply_text(f"Failed to update warnings: {str(e)}")
     else:
@@ -217,8 +201,7 @@ def warn(update: Update, context: CallbackContext):
 def clear_warns_for_user(update: Update, context: CallbackContext):
     msg = None
     chat_id = update.effective_chat.id
-    group_doc = firebase.DATABASE.collection('groups').document(str(chat_id))
-    group_data = group_doc.get().to_dict()
+    group_data = utils.fetch_group_info(update, context)
 
     if utils.is_user_admin(update, context):
         if not context.args:
@@ -228,15 +211,11 @@ def clear_warns_for_user(update: Update, context: CallbackContext):
             return
         username_to_clear = context.args[0].lstrip('@')
 
-        for user_id in group_data.get('warnings', {}):
+        for user_id in repository.groups.list_members(chat_id, 'warnings', group_data):
             try:
                 user_info = context.bot.get_chat_member(chat_id=chat_id, user_id=user_id).user
                 if user_info.username == username_to_clear:
-                    # Remove the user from the warnings mapping
-                    group_doc.update({
-                        f'warnings.{user_id}': firestore.DELETE_FIELD
-                    })
-                    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+                    repository.groups.delete_member(chat_id, 'warnings', user_id) # Remove the user from the warnings mapping
                     msg = update.message.reply_text(f"Warnings cleared for @{username_to_clear}.")
                     break
             except Exception:
@@ -259,11 +238,13 @@ def check_warn_list(update: Update, context: CallbackContext) -> None:
     group_id = update.effective_chat.id
     group_data = utils.fetch_group_info(update, context)
 
+    warnings = repository.groups.list_members(group_id, 'warnings', group_data) if group_data is not None else {}
+
     warn_list_text = '*Current Warned Users List:*\n\n'
-    if group_data is None or 'warnings' not in group_data or not group_data['warnings']:
+    if not warnings:
         warn_list_text += 'No users are currently warned.'
     else:
-        for user_id, warn_count in group_data['warnings'].items():
+        for user_id, warn_count in warnings.items():
             try:
                 user_info = context.bot.get_chat_member(chat_id=group_id, user_id=user_id).user
                 username = user_info.username
@@ -308,15 +289,11 @@ def check_warnings(update: Update, context: CallbackContext):
     msg = None
     if utils.is_user_admin(update, context) and update.message.reply_to_message:
         user_id = str(update.message.reply_to_message.from_user.id)
-        group_doc = utils.fetch_group_info(update, context, return_doc=True)
+        group_data = utils.fetch_group_info(update, context)
 
         try:
-            doc_snapshot = group_doc.get()
-            if doc_snapshot.exists:
-                group_data = doc_snapshot.to_dict()
-                warnings_dict = group_data.get('warnings', {})
-
-                current_warnings = warnings_dict.get(user_id, 0) # Get the warning count for the user
+            if group_data is not None:
+                current_warnings = repository.groups.get_member(update.effective_chat.id, 'warnings', user_id, default=0) # Get the warning count for the user
 
                 msg = update.message.reply_text(f"{user_id} has {current_warnings} warnings.")
             else:
@@ -378,14 +355,12 @@ def block(update: Update, context: CallbackContext):
                     msg = update.message.reply_text(f"'{command_text}' is already in the blocklist.")
                 else:
                     current_blocklist.append(command_text)  # Add new blocked text to the list
-                    group_doc.update({blocklist_field: current_blocklist})  # Update the blocklist in the group's document
+                    repository.groups.update(update.effective_chat.id, {blocklist_field: current_blocklist})  # Update the blocklist in the group's document
                     msg = update.message.reply_text(f"'{command_text}' added to blocklist!")
-                    utils.clear_group_cache(str(update.effective_chat.id))  # Clear the cache on all database updates
                     print("Updated blocklist:", current_blocklist)
             else:
-                group_doc.set({blocklist_field: [command_text]})  # If no blocklist exists, create it with the current command text
+                repository.groups.set(update.effective_chat.id, {blocklist_field: [command_text]})  # If no blocklist exists, create it with the current command text
                 msg = update.message.reply_text(f"'{command_text}' blocked!")
-                utils.clear_group_cache(str(update.effective_chat.id))  # Clear the cache on all database updates
                 print("Created new blocklist with:", [command_text])
 
         except Exception as e:
@@ -406,13 +381,11 @@ def remove_block(update: Update, context: CallbackContext):
                 utils.track_message(msg)
             return
 
-        group_doc = utils.fetch_group_info(update, context, return_doc=True)
         blocklist_field = 'blocklist'
 
         try: # Use Firestore's arrayRemove to remove the item from the blocklist array
-            group_doc.update({blocklist_field: firestore.ArrayRemove([command_text])})
+            repository.groups.update(update.effective_chat.id, {blocklist_field: firestore.ArrayRemove([command_text])})
             msg = update.message.reply_text(f"'{command_text}' removed from the blocklist!")
-            utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
             print(f"Removed '{command_text}' from the blocklist.")
         
         except Exception as e:
@@ -468,20 +441,17 @@ def allow(update: Update, context: CallbackContext):
                 utils.track_message(msg)
             return
 
-        group_doc = utils.fetch_group_info(update, context, return_doc=True)
         allowlist_field = 'allowlist'
 
         try: # Use Firestore's arrayUnion to add the item to the allowlist array
-            group_doc.update({allowlist_field: firestore.ArrayUnion([command_text])}) 
+            repository.groups.update(update.effective_chat.id, {allowlist_field: firestore.ArrayUnion([command_text])}) 
             msg = update.message.reply_text(f"'{command_text}' added to the allowlist!")
-            utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
             print(f"Added '{command_text}' to allowlist.")
 
         except Exception as e:
             if 'NOT_FOUND' in str(e): # Handle the case where the document doesn't exist
-                group_doc.set({allowlist_field: [command_text]})
+                repository.groups.set(update.effective_chat.id, {allowlist_field: [command_text]})
                 msg = update.message.reply_text(f"'{command_text}' added to a new allowlist!")
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
                 print(f"Created new allowlist with: {command_text}")
             else:
                 msg = update.message.reply_text(f"Failed to update allowlist: {str(e)}")
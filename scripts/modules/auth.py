@@ -10,7 +10,8 @@ from telegram.ext import CallbackContext
 # {config.py} - Environment variables and global variables used in the bot
 # {utils.py} - Utility functions and variables used in the bot
 # {firebase.py} - Firebase configuration and database initialization
-from modules import config, utils, firebase
+# {repository.py} - Write-through access to group documents
+from modules import config, utils, firebase, repository
 
 #region User Authentication
 def authentication_callback(update: Update, context: CallbackContext) -> None:
@@ -21,17 +22,15 @@ def authentication_callback(update: Update, context: CallbackContext) -> None:
 
     print(f"Authenticating user {user_id} for group {group_id}")
 
-    group_doc = firebase.DATABASE.collection('groups').document(group_id)
-    group_data = group_doc.get().to_dict()
+    group_data = utils.fetch_group_info(update, context, group_id=group_id)
 
     if group_data:
-        unverified_users = group_data.get('unverified_users', {})  # Get as dictionary
         authentication_info = group_data.get('verification_info', {})
         authentication_type = authentication_info.get('verification_type', 'simple')
 
         print(f"Authentication type: {authentication_type}")
 
-        if str(user_id) in unverified_users: # Check if the user ID is in the KEYS of the unverified_users mapping
+        if repository.groups.is_member(group_id, 'unverified_users', user_id, fresh=True): # Check if the user ID is in the KEYS of the unverified_users mapping
             if authentication_type == 'simple':
                 authenticate_user(context, group_id, user_id)
             elif authentication_type == 'math' or authentication_type == 'word':
@@ -48,8 +47,6 @@ def authentication_callback(update: Update, context: CallbackContext) -> None:
         query.edit_message_text(text="No such group exists.")
 
 def authentication_challenge(update: Update, context: CallbackContext, authentication_type, group_id, user_id):
-    group_doc = utils.fetch_group_info(update, context, return_doc=True, group_id=group_id)
-
     if authentication_type == 'math':
         challenges = [config.MATH_0, config.MATH_1, config.MATH_2, config.MATH_3, config.MATH_4]
         index = random.randint(0, 4)
@@ -93,10 +90,9 @@ def authentication_challenge(update: Update, context: CallbackContext, authentic
             reply_markup=reply_markup
         )
 
-        group_doc.update({ # Update Firestore with the challenge
-            f'unverified_users.{user_id}.challenge': math_challenge
+        repository.groups.update_member(group_id, 'unverified_users', user_id, { # Update Firestore with the challenge
+            'challenge': math_challenge
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
         print(f"Stored math challenge for user {user_id} in group {group_id}: {math_challenge}")
 
     elif authentication_type == 'word':
@@ -128,10 +124,9 @@ def authentication_challenge(update: Update, context: CallbackContext, authentic
             reply_markup=reply_markup
         )
     
-        group_doc.update({ # Update Firestore with the challenge
-            f'unverified_users.{user_id}.challenge': word_challenge
+        repository.groups.update_member(group_id, 'unverified_users', user_id, { # Update Firestore with the challenge
+            'challenge': word_challenge
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
         print(f"Stored word challenge for user {user_id} in group {group_id}: {word_challenge}")
     
     else:
@@ -152,30 +147,20 @@ def callback_word_response(update: Update, context: CallbackContext):
 
     print(f"User ID: {user_id} - Group ID: {group_id} - Response: {response}")
 
-    group_doc = firebase.DATABASE.collection('groups').document(group_id)
-    group_data = group_doc.get()
-
-    if group_data.exists:
-        group_data_dict = group_data.to_dict()
+    user_challenge_data = repository.groups.get_member(group_id, 'unverified_users', user_id, fresh=True, default=repository.MISSING) # Get the user's challenge data
 
-        if str(user_id) in group_data_dict.get('unverified_users', {}): # Check if the user is in the unverified users mapping
-            user_challenge_data = group_data_dict['unverified_users'][str(user_id)] # Get the user's challenge data
-            challenge_answer = user_challenge_data.get('challenge')  # Extract only the challenge value as the required answer
+    if user_challenge_data is not repository.MISSING: # Check if the user is in the unverified users mapping
+        challenge_answer = (user_challenge_data or {}).get('challenge')  # Extract only the challenge value as the required answer
 
-            print(f"Challenge answer: {challenge_answer}")
-
-            if response == challenge_answer:
-                authenticate_user(context, group_id, user_id)
-            else:
-                authentication_failed(update, context, group_id, user_id)
+        print(f"Challenge answer: {challenge_answer}")
 
+        if response == challenge_answer:
+            authenticate_user(context, group_id, user_id)
         else:
-            query.edit_message_caption(
-                caption="Authentication data not found. Please start over or contact an admin."
-            )
+            authentication_failed(update, context, group_id, user_id)
     else:
         query.edit_message_caption(
-            caption="Group data not found. Please start over or contact an admin."
+            caption="Authentication data not found. Please start over or contact an admin."
         )
 
 def callback_math_response(update: Update, context: CallbackContext):
@@ -191,41 +176,31 @@ def callback_math_response(update: Update, context: CallbackContext):
 
     print(f"User ID: {user_id} - Group ID: {group_id} - Response: {response}")
 
-    group_doc = firebase.DATABASE.collection('groups').document(group_id)
-    group_data = group_doc.get()
-
-    if group_data.exists:
-        group_data_dict = group_data.to_dict()
+    user_challenge_data = repository.groups.get_member(group_id, 'unverified_users', user_id, fresh=True, default=repository.MISSING) # Get the user's challenge data
 
-        if str(user_id) in group_data_dict.get('unverified_users', {}): # Check if the user is in the unverified users mapping
-            user_challenge_data = group_data_dict['unverified_users'][str(user_id)] # Get the user's challenge data
-            challenge_answer = user_challenge_data.get('challenge')  # Extract only the challenge value as the required answer
+    if user_challenge_data is not repository.MISSING: # Check if the user is in the unverified users mapping
+        challenge_answer = (user_challenge_data or {}).get('challenge')  # Extract only the challenge value as the required answer
 
-            print(f"Challenge answer: {challenge_answer}")
+        print(f"Challenge answer: {challenge_answer}")
 
-            if response == challenge_answer:
-                authenticate_user(context, group_id, user_id)
-            else:
-                authentication_failed(update, context, group_id, user_id)
+        if response == challenge_answer:
+            authenticate_user(context, group_id, user_id)
         else:
-            query.edit_message_caption(
-                caption="Authentication data not found. Please start over or contact an admin."
-            )
+            authentication_failed(update, context, group_id, user_id)
     else:
         query.edit_message_caption(
-            caption="Group data not found. Please start over or contact an admin."
+            caption="Authentication data not found. Please start over or contact an admin."
         )
 
 def authenticate_user(context, group_id, user_id):
     # Always check the database when authenticating the user
     # This is to avoid using stale cached data
-    group_doc = firebase.DATABASE.collection('groups').document(group_id)
-    group_data = group_doc.get().to_dict()
+    unverified_user = repository.groups.get_member(group_id, 'unverified_users', user_id, fresh=True, default=repository.MISSING)
 
     print(f"Authenticating user {user_id} in group {group_id}")
 
-    if 'unverified_users' in group_data and user_id in group_data['unverified_users']:
-        join_message_id = group_data['unverified_users'][user_id].get('join_message_id')
+    if unverified_user is not repository.MISSING:
+        join_message_id = (unverified_user or {}).get('join_message_id')
         if join_message_id:
             try: # Attempt to delete the join message
                 context.bot.delete_message(
@@ -236,12 +211,9 @@ def authenticate_user(context, group_id, user_id):
             except Exception as e:
                 print(f"Failed to delete join message {join_message_id} for user {user_id}: {e}")
 
-        del group_data['unverified_users'][user_id]
+        repository.groups.delete_member(group_id, 'unverified_users', user_id) # Remove only this user instead of rewriting the whole document
         print(f"Removed user {user_id} from unverified users in group {group_id}")
 
-        group_doc.set(group_data) # Write the updated group data back to Firestore
-        utils.clear_group_cache(str(group_id)) # Clear the cache on all database updates
-
     context.bot.send_message(
         chat_id=user_id,
         text="Authentication successful! You may now participate in the group chat."
@@ -263,17 +235,11 @@ def authenticate_user(context, group_id, user_id):
 
 def authentication_failed(update: Update, context: CallbackContext, group_id, user_id):
     print(f"Authentication failed for user {user_id} in group {group_id}")
-    group_doc = utils.fetch_group_info(update, context, return_doc=True, group_id=group_id)
-    group_data = group_doc.get().to_dict()
-
-    if 'unverified_users' in group_data and user_id in group_data['unverified_users']:
-        group_data['unverified_users'][user_id] = None
+    if repository.groups.is_member(group_id, 'unverified_users', user_id):
+        repository.groups.update_member(group_id, 'unverified_users', user_id, {'challenge': None})
 
     print(f"Reset challenge for user {user_id} in group {group_id}")
 
-    group_doc.set(group_data) # Write the updated group data back to Firestore
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     context.bot.delete_message(
         chat_id=update.effective_chat.id,
         message_id=update.callback_query.message.message_id
@@ -1,7 +1,14 @@
 import re
+import json
+import math
+import time
 import openai
+import heapq
 import random
-from threading import Timer
+import hashlib
+import threading
+from collections import Counter
+from cachetools import LRUCache
 from telegram import Update
 from telegram.ext import CallbackContext
 
@@ -19,11 +26,40 @@ FREQUENCY = 1  # AI repetition penalty
 PRESENCE = 0.25  # AI context awareness
 OPENAI_MODEL = "gpt-4o-mini"  # OpenAI model to use
 PROMPT_PATTERN = r"^(hey sypher(?:bot)?)\s*(.*)$"  # Matches "hey sypher" or "hey sypherbot" at the start
+SINGLE_CALL = True  # Route and answer in one tool-calling request, the intent + response requests are kept as a fallback
+SYSTEM_PROMPT = (
+    "You are Sypherbot a telegram bot created by Tukyo. "
+    "Your users are mostly degens and crypto traders. "
+    "Answer using group context and intent. Keep responses concise and under 40 words unless more detail is requested. "
+    "Do not add unnecessary generic offers for assistance, polite endings, greetings, or commentary. "
+    "Never cut off responses mid-thought."
+)
+TOOL_PROMPT = " Only call a function when the query needs live market data that is not in the context."
+ROUTER_MIN_SCORE = 1.0  # Minimum keyword evidence before the local intent router trusts a match
+ROUTER_CONFIDENCE = 0.75  # Share of the keyword evidence the best function needs, below this the LLM classifies the query
+CONTEXT_TOKEN_BUDGET = 300  # Maximum estimated tokens of group context per prompt
+CHARS_PER_TOKEN = 4  # Rough estimate for English text and addresses, good enough to keep prompts bounded
+CONTEXT_MAX_LIST_ITEMS = 10  # Longer lists (users, warnings) are cut with a "+N more" marker
+CONTEXT_SECTIONS = {  # Group dictionary sections each routed intent needs, anything else gets every section
+    "fetch_token_price": ["token_info"],
+    "fetch_trending_coins": ["token_info"],
+    "fetch_fear_greed_index": ["token_info"],
+}
+CONTEXT_SECTION_ORDER = ["token_info", "group_info", "commands", "premium", "premium_features", "verification", "admin_settings"]  # Kept first when the budget runs out
+EMPTY_CONTEXT_VALUES = {"", "N/A", "Unknown Token", "Unknown Group ID", "Unknown Owner"}  # Defaults fetch_group_dictionary fills in for missing fields
 
 ongoing_conversations = {} # Dictionary to store ongoing conversations
+conversations_lock = threading.Lock() # Guards ongoing_conversations between handler threads and the expiry thread
 RESPONSE_CACHE_SIZE = 10  # Number of responses to cache
 response_cache = {} # Cached response mapping per user for the AI to use (clears daily)
 PROMPT_TIMEOUT = 10  # Timeout for conversation prompts in seconds
+ANSWER_CACHE_SIZE = 5000  # Answers shared between users of the same group, least recently used are evicted
+ANSWER_DEFAULT_TTL = 300  # Seconds a cached answer is reused when its registry function sets no cache_ttl
+ANSWER_STATIC_TTL = 3600  # Seconds for static facts, the group dictionary hash in the key invalidates them on change
+ANSWER_REPORT_INTERVAL = 100  # Lookups between hit rate reports
+STATIC_FACT_TERMS = {"ca", "contract", "address", "website", "site", "link", "chain", "symbol", "ticker", "supply", "decimals", "owner", "dev", "name"}
+PERSONAL_TERMS = {"i", "i'm", "im", "me", "my", "mine", "am"}  # Questions about the asker are never shared, e.g. "am I verified?"
+QUERY_FILLER_WORDS = {"a", "an", "the", "is", "are", "what", "what's", "whats", "pls", "please", "plz", "can", "you", "me", "tell", "give", "our", "of", "for"}
 
 ERROR_REPLIES = [
     "Sorry, I didn't understand that. Please try rephrasing.",
@@ -102,8 +138,7 @@ def prompt_handler(update: Update, context: CallbackContext) -> None:
     
     print(f"Processing query from user {user_id} in chat {group_id}: {query}")
 
-    # Admin dictionary MIGHT be too big for processing correctly with 10 tokens...
-    # LATER TODO: Implement a way to split the dictionary into smaller chunks for processing
+    # Admin dictionary used to be too big to send as is, build_group_context now trims any dictionary to CONTEXT_TOKEN_BUDGET
     # if not utils.is_user_admin(update, context): # If admin triggered the bot, get the entire group dictionary
     #     dictionary = utils.fetch_group_dictionary(update, context)
     # else:
@@ -114,51 +149,103 @@ def prompt_handler(update: Update, context: CallbackContext) -> None:
         print(f"No dictionary found for chat {update.message.chat_id}. Proceeding without group-specific context.")
         return None
     
-    intent = determine_intent(query, group_dictionary) # Determine the user's intent
-    
-    if last_response is not None and replied_message is None: # Last response is found
-        context_info = determine_context(update, context, intent, query, group_dictionary, user_id, username, last_response, None)
-    elif replied_message is not None: # Replied message is found
-        context_info = determine_context(update, context, intent, query, group_dictionary, user_id, username, None, replied_message)
-    else: # Neither last response nor replied message is found, most likely a new "hey sypher" message
-        context_info = determine_context(update, context, intent, query, group_dictionary, user_id, username, None, None)
+    previous_response = last_response if replied_message is None else None # A replied message takes precedence over the conversation
 
-    messages = [
-        {"role": "system", "content": (
-            "You are Sypherbot a telegram bot created by Tukyo. "
-            "Your users are mostly degens and crypto traders. "
-            "Answer using group context and intent. Keep responses concise and under 40 words unless more detail is requested. "
-            "Do not add unnecessary generic offers for assistance, polite endings, greetings, or commentary. "
-            "Never cut off responses mid-thought."
-        )},
-        {"role": "user", "content": context_info}
-    ]
+    routed_intent = router.route(query) # Recognizable queries skip LLM classification
 
-    try:  # Call OpenAI API with the new `ChatCompletion.create` syntax
-        openai_response = openai.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            max_tokens=MAX_RESPONSE_TOKENS,
-            temperature=TEMPERATURE,
-            frequency_penalty=FREQUENCY,
-            presence_penalty=PRESENCE
-        )
-        response_message = openai_response.choices[0].message.content.strip()  # Extract the response text
-    except Exception as e:
-        error_reply = update.message.reply_text("Sorry, I couldn't process your request. Try again later.")
-        print(f"OpenAI API error: {e}")
-        return error_reply
+    shared = previous_response is None and replied_message is None and is_shared_answer(query, routed_intent) # Follow-ups depend on the conversation, only fresh group-level queries are shared
+    cache_key = answer_cache.key(group_id, query, group_dictionary) if shared else None
+    cached_answer = answer_cache.get(cache_key) if cache_key else None
+    if cached_answer is not None:
+        update.message.reply_text(cached_answer)
+        print(f"Cached response in chat {group_id}: {cached_answer}")
+        cache_interaction(user_id, query, cached_answer)
+        return cached_answer
+
+    if cache_key: # Shared answers are built without the asker's @handle and history, so they fit every user in the group
+        prompt_user_id, prompt_username = None, None
+    else:
+        prompt_user_id, prompt_username = user_id, username
+
+    response_message = None
+    if SINGLE_CALL:
+        try:
+            response_message = answer_with_tools(update, context, query, group_dictionary, prompt_user_id, prompt_username, previous_response, replied_message, routed_intent)
+        except Exception as e:
+            print(f"Single-call prompt failed, falling back to intent classification: {e}")
+
+    if response_message is None: # Two-call path, classify the intent first and then answer with it
+        intent = routed_intent or determine_intent(query, group_dictionary) # Determine the user's intent
+        context_info = determine_context(update, context, intent, query, group_dictionary, prompt_user_id, prompt_username, previous_response, replied_message)
+
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": context_info}
+        ]
+
+        try:
+            openai_response = create_completion(messages)
+            response_message = openai_response.choices[0].message.content.strip()  # Extract the response text
+        except Exception as e:
+            error_reply = update.message.reply_text("Sorry, I couldn't process your request. Try again later.")
+            print(f"OpenAI API error: {e}")
+            return error_reply
 
     if response_message:  # Send the response back to the user
         update.message.reply_text(response_message)
         print(f"Response in chat {update.message.chat_id}: {response_message}")
         cache_interaction(user_id, query, response_message)
+        if cache_key:
+            answer_cache.set(cache_key, response_message, answer_ttl(query, routed_intent))
         return response_message
     else:
         error_reply = random.choice(ERROR_REPLIES)
         update.message.reply_text(error_reply)
         print("Error determining response, sending a random error reply")
         return error_reply
+
+def answer_with_tools(update: Update, context: CallbackContext, query: str, group_dictionary: dict, user_id: str, username: str, last_response: str = None, replied_message: str = None, routed_intent: str = None) -> str:
+    if routed_intent is not None: # The router already picked a function, run it here and skip the tool round trip
+        result = run_function(routed_intent, update, context, query)
+        if result is not None:
+            context_info = build_context(query, group_dictionary, user_id, username, last_response, replied_message, routed_intent, format_function_result(result))
+            message = create_completion([{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": context_info}]).choices[0].message
+            print(f"Routed response for query: {query}")
+            return (message.content or "").strip()
+
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT + TOOL_PROMPT},
+        {"role": "user", "content": build_context(query, group_dictionary, user_id, username, last_response, replied_message)}
+    ]
+
+    message = create_completion(messages, tools=TOOLS, tool_choice="auto").choices[0].message
+    if message.tool_calls: # The model needs live data, run the functions and let it answer with their results
+        messages.append({
+            "role": "assistant",
+            "content": message.content,
+            "tool_calls": [
+                {"id": tool_call.id, "type": "function", "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}}
+                for tool_call in message.tool_calls
+            ]
+        })
+        for tool_call in message.tool_calls:
+            messages.append({"role": "tool", "tool_call_id": tool_call.id, "content": run_tool_call(update, context, tool_call)})
+
+        message = create_completion(messages, tools=TOOLS, tool_choice="none").choices[0].message
+
+    print(f"Single-call response for query: {query}")
+    return (message.content or "").strip()
+
+def create_completion(messages: list, **kwargs):
+    return openai.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=messages,
+        max_tokens=MAX_RESPONSE_TOKENS,
+        temperature=TEMPERATURE,
+        frequency_penalty=FREQUENCY,
+        presence_penalty=PRESENCE,
+        **kwargs
+    )
 #endregion Prompt Handling
 ##
 #
@@ -172,7 +259,7 @@ def determine_intent(query: str, group_dictionary: dict) -> str:
         "Analyze the following query and classify it based on the context provided below. "
         "Describe the user's intent as clearly and specifically as possible using the provided query and context. "
         "If the query is ambiguous or the context is insufficient, determine the intent with reasoning and explain your conclusion."
-        f"\n\nContext:\n{group_dictionary}\n\nQuery:\n{query}"
+        f"\n\nContext:\n{build_group_context(group_dictionary)}\n\nQuery:\n{query}"
     )
 
     try:
@@ -191,8 +278,26 @@ def determine_intent(query: str, group_dictionary: dict) -> str:
         return "unknown"
     
 def determine_context(update: Update, context: CallbackContext, intent: str, query: str, group_dictionary: dict, user_id: str, username: str, last_response: str = None, replied_message: str = None) -> str:
-    context_info = f"Context: {group_dictionary}\n"
-    context_info += f"Username: @{username}\n"
+    func_name = intent if intent in FUNCTION_REGISTRY else router.route(intent) # LLM intents are free text, route the description like a query
+
+    function_result = None
+    if func_name:  # Execute the matched function if found
+        try:
+            result = run_function(func_name, update, context, query)
+            if result:
+                function_result = format_function_result(result)
+        except Exception as e:
+            print(f"Error executing function: {e}")
+            error_reply = random.choice(ERROR_REPLIES)
+            update.message.reply_text(error_reply)
+            return error_reply
+
+    return build_context(query, group_dictionary, user_id, username, last_response, replied_message, intent, function_result)
+
+def build_context(query: str, group_dictionary: dict, user_id: str, username: str, last_response: str = None, replied_message: str = None, intent: str = None, function_result: str = None) -> str:
+    context_info = f"Context:\n{build_group_context(group_dictionary, intent)}\n"
+    if username is not None: # None for prompts whose answer is shared through the answer cache
+        context_info += f"Username: @{username}\n"
 
     if last_response is not None: # If a previous response is found in the conversation context
         context_info += f"Previous Response: {last_response}\nQuery: {query}\n"
@@ -200,46 +305,69 @@ def determine_context(update: Update, context: CallbackContext, intent: str, que
     elif replied_message is not None: # If a replied message is found in the conversation context
         context_info += f"Replied Message: {replied_message}\nQuery: {query}\n" 
         print(f"Replied message found in conversation context: {replied_message}")
-    elif replied_message is None and last_response is None: # No reply or last response found
+    elif intent is not None: # No reply or last response found
         context_info += f"Query: {query} || Intent: {intent}\n"
         print("No previous response found in conversation context.")
+    else: # Single-call prompts have no separate intent to pass along
+        context_info += f"Query: {query}\n"
 
-    matched_function = ( # After determining the intent, check if a function should be called
-        FUNCTION_REGISTRY.get(intent, {}).get("function")  # Match by intent first
-        or match_function_by_keywords(query)  # Fallback to keyword-based matching
-    )
-
-    matched_function = None
-    for func_name, details in FUNCTION_REGISTRY.items():
-        if details.get("intent") == intent:
-            matched_function = details["function"]
-            print(f"Matched function by intent: {func_name}")
-            break
+    if function_result:
+        context_info += f"\n{function_result}\n"
 
-    if matched_function:  # Execute the matched function if found
-        try:
-            result = matched_function(update, context)
-            if result:
-                if isinstance(result, list):
-                    formatted_result = "Function Result:\n" + "\n".join(f"- {item}" for item in result)
-                elif isinstance(result, dict):
-                    formatted_result = "Function Result:\n" + "\n".join(f"{key}: {value}" for key, value in result.items())
-                else:
-                    formatted_result = f"Function Result:\n{result}"
-
-                context_info += f"\n{formatted_result}\n"
-        except Exception as e:
-            print(f"Error executing function: {e}")
-            error_reply = random.choice(ERROR_REPLIES)
-            update.message.reply_text(error_reply)
-            return error_reply
-        
-    cached_interactions = get_interaction_cache(user_id)  # Get the recent responses for the user
-    if cached_interactions is not "No recent responses in cache for this user.":  # If there are cached responses, include them in the context
+    cached_interactions = get_interaction_cache(user_id) if user_id is not None else None  # Get the recent responses for the user
+    if cached_interactions is not None:  # If there are cached responses, include them in the context
         context_info += f"\n{cached_interactions}"
     
     print(f"Context for prompt: {context_info}")
     return context_info
+
+def build_group_context(group_dictionary: dict, intent: str = None, budget: int = CONTEXT_TOKEN_BUDGET) -> str: # One key=value line per section, only what the intent needs
+    sections = CONTEXT_SECTIONS.get(intent) or sorted(group_dictionary, key=context_priority)
+
+    lines = []
+    used = 0
+    for section in sections:
+        text = compact_value(group_dictionary.get(section), nested=False)
+        if text is None:
+            continue
+
+        line = f"{section}: {text}"
+        cost = estimate_tokens(line)
+        if used + cost > budget: # A smaller section further down may still fit
+            print(f"Context budget of {budget} tokens reached, dropped section {section}.")
+            continue
+        lines.append(line)
+        used += cost
+
+    return "\n".join(lines)
+
+def context_priority(section: str) -> int:
+    return CONTEXT_SECTION_ORDER.index(section) if section in CONTEXT_SECTION_ORDER else len(CONTEXT_SECTION_ORDER)
+
+def compact_value(value, nested: bool = True): # Flattens a value to text, None when it carries no information
+    if value is None or (isinstance(value, str) and value.strip() in EMPTY_CONTEXT_VALUES):
+        return None
+
+    if isinstance(value, dict):
+        if value and all(isinstance(item, bool) for item in value.values()): # Toggle maps become the list of what is on
+            return compact_value([key for key, item in value.items() if item], nested)
+        fields = [f"{key}={text}" for key, item in value.items() if (text := compact_value(item)) is not None]
+        if not fields:
+            return None
+        return f"({', '.join(fields)})" if nested else ", ".join(fields)
+
+    if isinstance(value, (list, tuple, set)):
+        items = [text for item in value if (text := compact_value(item)) is not None]
+        if not items:
+            return None
+        if len(items) > CONTEXT_MAX_LIST_ITEMS:
+            items = items[:CONTEXT_MAX_LIST_ITEMS] + [f"+{len(items) - CONTEXT_MAX_LIST_ITEMS} more"]
+        return f"[{', '.join(items)}]" if nested else ", ".join(items)
+
+    return str(value)
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
 #endregion Intention & Context
 ##   
 #
@@ -249,26 +377,58 @@ def determine_context(update: Update, context: CallbackContext, intent: str, que
 # The following functions are used to manage ongoing conversations with users in groups
 # The conversation state is stored in the ongoing_conversations dictionary
 # Each conversation is associated with a user_id and group_id
-# The conversation state includes the last response from the bot and a timer to clear the conversation
-def start_conversation(user_id, group_id, last_response): # Start or reset a conversation for a user in a group
-    key = (user_id, group_id)
+# The conversation state includes the last response from the bot and when the conversation expires
+# A single ConversationExpiry thread clears conversations once they expire, replies only push the deadline back
+class ConversationExpiry:
+    def __init__(self):
+        self.deadlines = [] # Heap of (expires_at, sequence, key), entries for conversations that were extended are skipped
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.thread = None
 
-    if key in ongoing_conversations: # If the user is already in a conversation, cancel the existing timer
-        ongoing_conversations[key]['timer'].cancel()
+    def schedule(self, key, expires_at):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.deadlines, (expires_at, self.sequence, key))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="conversation-expiry", daemon=True)
+                self.thread.start()
+            self.condition.notify()
 
-    timer = Timer(PROMPT_TIMEOUT, clear_conversation, [user_id, group_id]) # Clear the conversation after prompt_timeout
-    timer.start()
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.deadlines or self.deadlines[0][0] > time.monotonic():
+                    self.condition.wait(self.deadlines[0][0] - time.monotonic() if self.deadlines else None)
+                expires_at, _, key = heapq.heappop(self.deadlines)
+            expire_conversation(key, expires_at)
 
-    ongoing_conversations[key] = { # Store the conversation state
-        'timer': timer,
-        'last_response': last_response,
-    }
-    print(f"Started conversation for user {user_id} in group {group_id}.")
+conversation_expiry = ConversationExpiry()
 
-def clear_conversation(user_id, group_id): # Clear the conversation state for a user in a group
+def start_conversation(user_id, group_id, last_response): # Start or reset a conversation for a user in a group
     key = (user_id, group_id)
-    if key in ongoing_conversations:
+    expires_at = time.monotonic() + PROMPT_TIMEOUT # Clear the conversation after prompt_timeout
+
+    with conversations_lock:
+        ongoing_conversations[key] = { # Store the conversation state, an existing conversation just gets a later deadline
+            'expires_at': expires_at,
+            'last_response': last_response,
+        }
+    conversation_expiry.schedule(key, expires_at)
+    print(f"Started conversation for user {user_id} in group {group_id}.")
+
+def expire_conversation(key, expires_at): # Called by the expiry thread, ignores deadlines a later reply replaced
+    with conversations_lock:
+        conversation = ongoing_conversations.get(key)
+        if conversation is None or conversation['expires_at'] > expires_at:
+            return
         del ongoing_conversations[key]
+    print(f"Cleared conversation for user {key[0]} in group {key[1]}.")
+
+def clear_conversation(user_id, group_id): # Clear the conversation state for a user in a group
+    with conversations_lock:
+        conversation = ongoing_conversations.pop((user_id, group_id), None)
+    if conversation is not None:
         print(f"Cleared conversation for user {user_id} in group {group_id}.")
 
 def get_conversation_context(user_id, group_id): # Get the conversation context for a user in a group, or None if not active
@@ -278,7 +438,8 @@ def get_conversation_context(user_id, group_id): # Get the conversation context
     return None
 
 def get_conversation(user_id, group_id): # Get the conversation state for a user in a group, or None if not active
-    return ongoing_conversations.get((user_id, group_id))
+    with conversations_lock:
+        return ongoing_conversations.get((user_id, group_id))
 ##
 #endregion Conversation Management
 ##
@@ -296,13 +457,80 @@ def cache_interaction(user_id, query, response_message):
 
 def get_interaction_cache(user_id):
     if user_id not in response_cache or not response_cache[user_id]:
-        return "No recent interactions found for this user."
+        return None
 
     cache_summary = "\n".join(  # Format the cache as a readable summary
         f"{i+1}: Q: {interaction['query']} | A: {interaction['response']}"
         for i, interaction in enumerate(response_cache[user_id])
     )
     return f"Recent Interactions for User {user_id}:\n{cache_summary}"
+
+class AnswerCache: # Answers to fresh queries per group, keyed on the normalized query and a hash of the group dictionary
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE):
+        self.entries = LRUCache(maxsize=maxsize) # (group_id, query, version) -> (expires_at, response)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, group_id, query: str, group_dictionary: dict):
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+        version = hashlib.sha1(json.dumps(group_dictionary, sort_keys=True, default=str).encode()).hexdigest() # Any settings change starts a new version
+        return (str(group_id), normalized, version)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if (self.hits + self.misses) % ANSWER_REPORT_INTERVAL == 0:
+                print(f"Answer cache stats: {self.stats()}")
+
+        return entry[1] if entry is not None else None
+
+    def set(self, key, response: str, ttl: int):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, response)
+
+    def stats(self) -> dict: # Caller may hold the lock, only reads counters
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self.entries)
+        }
+
+def normalize_query(query: str) -> str: # Case, punctuation and filler words do not change the answer, word order does ("eth vs btc")
+    words = re.findall(r"[a-z0-9$'-]+", query.lower())
+    return " ".join(word for word in words if word not in QUERY_FILLER_WORDS)
+
+def is_shared_answer(query: str, func_name: str = None) -> bool: # Market data from a registry function or a static group fact, the same for everyone who asks
+    words = set(re.findall(r"[a-z0-9$'-]+", query.lower()))
+    if words & PERSONAL_TERMS:
+        return False
+    return func_name is not None or bool(words & STATIC_FACT_TERMS)
+
+def answer_ttl(query: str, func_name: str = None) -> int: # Anything that looks like live data expires with its function
+    live = [
+        FUNCTION_REGISTRY[name].get("cache_ttl", ANSWER_DEFAULT_TTL)
+        for name, score in router.scores(query).items()
+        if score > 0 or name == func_name
+    ]
+    if live:
+        return min(live)
+    if set(normalize_query(query).split()) & STATIC_FACT_TERMS:
+        return ANSWER_STATIC_TTL
+    return ANSWER_DEFAULT_TTL
+
+answer_cache = AnswerCache()
 #endregion Caching
 ##
 #
@@ -311,11 +539,22 @@ def get_interaction_cache(user_id):
 # The following functions are used to handle specific commands or queries from users
 # Each function is associated with a specific context and keywords for matching
 # The function registry stores the available functions and their metadata
+TOKEN_QUERY_PATTERN = r"(?:price of|price for|how much is|value of|cost of)\s+\$?([a-z0-9-]+)" # Token named right after a price phrase
+TOKEN_QUERY_SKIP = {"a", "my", "our", "the", "this", "that", "it", "token", "coin"}
+
+def extract_token_argument(query: str): # Arguments for fetch_token_price when the router runs it without the model
+    match = re.search(TOKEN_QUERY_PATTERN, query.lower())
+    if not match or match.group(1) in TOKEN_QUERY_SKIP:
+        return None
+    return {"token": match.group(1)}
+
 FUNCTION_REGISTRY = {
     "fetch_trending_coins": {
         "function": utils.fetch_trending_coins,
         "description": "Fetch trending cryptocurrency coins from CoinGecko.",
         "context": "crypto",
+        "parameters": None,
+        "cache_ttl": 300, # Seconds an answer built on this function stays cached
         "keywords": [
             "trending", "trending coins", "crypto trends", "popular coins", "hot coins",
             "top coins", "trending crypto", "top cryptocurrencies", "what's trending",
@@ -326,6 +565,15 @@ FUNCTION_REGISTRY = {
         "function": utils.fetch_token_price,
         "description": "Fetch the current price of a specific token from CoinGecko.",
         "context": "crypto",
+        "parameters": { # Functions with parameters are called with the arguments the model fills in, the rest with (update, context)
+            "type": "object",
+            "properties": {
+                "token": {"type": "string", "description": "CoinGecko id of the token, e.g. bitcoin, ethereum, pepe"}
+            },
+            "required": ["token"]
+        },
+        "arguments": extract_token_argument, # Fills the parameters from the query when the model is not asked
+        "cache_ttl": 30,
         "keywords": [
             "price", "token price", "crypto price", "current price", "how much is",
             "usd value", "crypto value", "price of", "cost of", "price check",
@@ -336,6 +584,8 @@ FUNCTION_REGISTRY = {
         "function": utils.fetch_fear_greed_index,
         "description": "Fetch the current Fear & Greed Index for cryptocurrency sentiment.",
         "context": "sentiment",
+        "parameters": None,
+        "cache_ttl": 600,
         "keywords": [
             "fear", "greed", "fear and greed", "market sentiment", "crypto sentiment",
             "sentiment index", "fng index", "market fear", "market greed", "market emotions",
@@ -343,14 +593,97 @@ FUNCTION_REGISTRY = {
         ]
     }
 }
-def match_function_by_keywords(query: str):
-    query = query.lower()
-    for func_name, details in FUNCTION_REGISTRY.items():  # Unpack key-value pairs from FUNCTION_REGISTRY
-        if details.get("intent") is None:  # Only consider functions without a clear intent
-            for keyword in details.get("keywords", []):
-                if keyword.lower() in query:
-                    print(f"Matched keyword: {keyword}, Function: {details['function'].__name__}")
-                    return details["function"]
-    print("No matching keyword found.")
-    return None
+ROUTER_STOPWORDS = {"a", "an", "and", "in", "is", "of", "the", "to", "what's", "whats", "how"}
+
+def keyword_terms(text: str) -> list: # Unigrams without stopwords plus every bigram
+    words = re.findall(r"[a-z0-9&'$-]+", text.lower())
+    return [word for word in words if word not in ROUTER_STOPWORDS] + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+class IntentRouter: # TF-IDF over the registry keywords, so common queries are routed without an LLM call
+    def __init__(self, registry, min_score=ROUTER_MIN_SCORE, confidence=ROUTER_CONFIDENCE):
+        self.min_score = min_score
+        self.confidence = confidence
+        self.weights = {} # func_name -> {term: weight}
+
+        documents = {
+            func_name: Counter(term for keyword in details.get("keywords", []) for term in keyword_terms(keyword))
+            for func_name, details in registry.items()
+        }
+        document_frequency = Counter(term for terms in documents.values() for term in terms)
+        for func_name, terms in documents.items():
+            self.weights[func_name] = {
+                term: (1 + math.log(count)) * math.log(1 + len(documents) / document_frequency[term]) * len(term.split()) # Bigrams count double
+                for term, count in terms.items()
+            }
+
+    def scores(self, query: str) -> dict:
+        terms = set(keyword_terms(query))
+        return {func_name: sum(weights.get(term, 0.0) for term in terms) for func_name, weights in self.weights.items()}
+
+    def route(self, query: str): # Returns the function name, or None when the query is not clearly about one function
+        scores = self.scores(query or "")
+        total = sum(scores.values())
+        if not total:
+            return None
+
+        func_name = max(scores, key=scores.get)
+        confidence = scores[func_name] / total
+        if scores[func_name] < self.min_score or confidence < self.confidence:
+            print(f"Router unsure about query ({func_name}, {confidence:.2f}), leaving it to the model.")
+            return None
+
+        print(f"Routed query to {func_name} ({confidence:.2f}).")
+        return func_name
+
+def run_function(func_name: str, update: Update, context: CallbackContext, query: str, arguments: dict = None):
+    details = FUNCTION_REGISTRY[func_name]
+    if not details.get("parameters"):
+        return details["function"](update, context)
+
+    if arguments is None: # Not a tool call, the registry has to find the arguments in the query
+        arguments = details["arguments"](query)
+        if arguments is None:
+            print(f"No arguments found in the query for {func_name}.")
+            return None
+    return details["function"](**arguments)
+
+def build_tools() -> list: # OpenAI tool definitions for the single-call path
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": func_name,
+                "description": details["description"],
+                "parameters": details.get("parameters") or {"type": "object", "properties": {}}
+            }
+        }
+        for func_name, details in FUNCTION_REGISTRY.items()
+    ]
+
+def run_tool_call(update: Update, context: CallbackContext, tool_call) -> str:
+    func_name = tool_call.function.name
+    details = FUNCTION_REGISTRY.get(func_name)
+    if details is None:
+        print(f"Model called an unknown function: {func_name}")
+        return f"Error: Unknown function {func_name}."
+
+    try:
+        arguments = json.loads(tool_call.function.arguments or "{}")
+        result = run_function(func_name, update, context, None, arguments)
+    except Exception as e:
+        print(f"Error executing function {func_name}: {e}")
+        return f"Error: Unable to run {func_name}."
+
+    print(f"Executed function by tool call: {func_name}")
+    return format_function_result(result) if result else "No result."
+
+def format_function_result(result) -> str:
+    if isinstance(result, list):
+        return "Function Result:\n" + "\n".join(f"- {item}" for item in result)
+    elif isinstance(result, dict):
+        return "Function Result:\n" + "\n".join(f"{key}: {value}" for key, value in result.items())
+    return f"Function Result:\n{result}"
+
+TOOLS = build_tools()
+router = IntentRouter(FUNCTION_REGISTRY)
 #endregion Function Handling & Registry
@@ -0,0 +1,164 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+#region Group Cache
+GROUP_CACHE_SIZE = 2000 # Maximum number of groups held in memory before the least recently used is evicted
+GROUP_CACHE_TTL = 900 # Seconds a cached group is trusted before it is re-read from Firestore
+GROUP_WATCH_LIMIT = 200 # Cached groups that also get a snapshot listener, every listener is a gRPC stream with its own thread
+GROUP_WATCH_IDLE = 300 # Seconds without use after which a group's listener may be handed to another group
+class GroupCache: # Bounded LRU cache for group documents, the busiest ones are kept fresh by Firestore snapshot listeners
+    def __init__(self, maxsize, ttl, watch_limit=GROUP_WATCH_LIMIT):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.watch_limit = watch_limit
+        self.watch_count = 0
+        self.entries = OrderedDict() # group_id -> {"group_data", "group_doc", "expires_at", "used_at", "watch", "derived"}
+        self.lock = threading.RLock()
+        self.releases = queue.Queue() # Listeners to unsubscribe, drained by one thread since unsubscribing blocks
+        self.release_thread = None
+        self.overlay = None # Set by the repository, (group_id, group_data) -> group_data with writes Firestore doesn't have yet
+        print(f"Initialized GroupCache with maxsize={maxsize}, ttl={ttl}")
+
+    def get(self, group_id: str) -> dict | None:
+        group_id = str(group_id)
+        with self.lock:
+            entry = self.entries.get(group_id)
+            if entry is None:
+                return None
+
+            if entry["expires_at"] <= time.monotonic(): # Stale entries are dropped so the next read goes to Firestore
+                print(f"Cache entry for group {group_id} expired.")
+                self._remove(group_id)
+                return None
+
+            self.entries.move_to_end(group_id) # Mark as most recently used
+            entry["used_at"] = time.monotonic()
+            return entry
+
+    def set(self, group_id: str, group_data: dict, group_doc: object) -> None:
+        group_id = str(group_id)
+        current_time = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(group_id)
+            watch = entry["watch"] if entry else None
+            derived = entry["derived"] if entry else {} # Kept across updates, derive() re-checks its source
+
+            self.entries[group_id] = {
+                "group_data": group_data,
+                "group_doc": group_doc,
+                "expires_at": current_time + self.ttl,
+                "used_at": current_time,
+                "watch": watch,
+                "derived": derived
+            }
+            self.entries.move_to_end(group_id)
+
+            while len(self.entries) > self.maxsize: # Evict the least recently used groups
+                oldest_id = next(iter(self.entries))
+                print(f"Evicting group {oldest_id} from cache.")
+                self._remove(oldest_id)
+
+            if watch is None and group_doc is not None and self._claim_watch(current_time): # Groups without a listener rely on the TTL and write-through updates
+                self.entries[group_id]["watch"] = self._watch(group_id, group_doc)
+
+    def delete(self, group_id: str) -> bool:
+        group_id = str(group_id)
+        with self.lock:
+            if group_id not in self.entries:
+                return False
+            self._remove(group_id)
+            return True
+
+    def derive(self, group_id: str, key: str, source, builder): # Memoizes builder(source) on the group's entry until the source value changes
+        group_id = str(group_id)
+        with self.lock:
+            entry = self.entries.get(group_id)
+            cached = entry["derived"].get(key) if entry else None
+            if cached is not None:
+                cached_source, value = cached
+                if cached_source is source: # Same object as last time, nothing changed
+                    return value
+                if cached_source == source: # Group data was replaced but this field is unchanged
+                    entry["derived"][key] = (source, value)
+                    return value
+
+        value = builder(source) # Build outside the lock, compiling can take a while on large lists
+        with self.lock:
+            entry = self.entries.get(group_id)
+            if entry is not None:
+                entry["derived"][key] = (source, value)
+                print(f"Rebuilt {key} for group {group_id}.")
+        return value
+
+    def _remove(self, group_id: str) -> None: # Caller must hold the lock
+        entry = self.entries.pop(group_id, None)
+        if entry is not None:
+            self._release(entry)
+
+    def _claim_watch(self, current_time: float) -> bool: # Caller must hold the lock, True when a listener slot is free
+        if self.watch_count < self.watch_limit:
+            return True
+
+        for entry in self.entries.values(): # Least recently used first
+            if entry["watch"] is not None:
+                if current_time - entry["used_at"] < GROUP_WATCH_IDLE:
+                    return False # Every watched group has been used recently, keep their listeners
+                self._release(entry)
+                return True
+        return False
+
+    def _watch(self, group_id: str, group_doc: object): # Subscribe to pushes for this document so out-of-process writes refresh the entry
+        try:
+            watch = group_doc.on_snapshot(
+                lambda doc_snapshots, changes, read_time: self._on_snapshot(group_id, doc_snapshots)
+            )
+        except Exception as e:
+            print(f"Failed to attach snapshot listener for group {group_id}: {e}")
+            return None
+        self.watch_count += 1
+        return watch
+
+    def _release(self, entry: dict) -> None: # Caller must hold the lock
+        if entry["watch"] is None:
+            return
+        self.releases.put(entry["watch"])
+        entry["watch"] = None
+        self.watch_count -= 1
+        if self.release_thread is None:
+            self.release_thread = threading.Thread(target=self._run_releases, daemon=True)
+            self.release_thread.start()
+
+    def _run_releases(self) -> None: # Unsubscribing joins the listener thread, so never do it on the caller's (or the listener's own) thread
+        while True:
+            watch = self.releases.get()
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print(f"Failed to release snapshot listener: {e}")
+
+    def _on_snapshot(self, group_id: str, doc_snapshots) -> None:
+        snapshot = doc_snapshots[0] if doc_snapshots else None
+        group_data = None
+        if snapshot is not None and snapshot.exists:
+            group_data = snapshot.to_dict()
+            if self.overlay is not None: # Buffered writes would otherwise look reverted until they are committed
+                group_data = self.overlay(group_id, group_data)
+
+        with self.lock:
+            entry = self.entries.get(group_id)
+            if entry is None: # Entry was evicted while the listener was shutting down
+                return
+
+            if group_data is None:
+                print(f"Group {group_id} was deleted in Firestore. Dropping cache entry.")
+                self._remove(group_id)
+                return
+
+            entry["group_data"] = group_data
+            entry["expires_at"] = time.monotonic() + self.ttl
+            print(f"Refreshed cache for group {group_id} from snapshot listener.")
+
+group_cache = GroupCache(maxsize=GROUP_CACHE_SIZE, ttl=GROUP_CACHE_TTL)
+#endregion Group Cache
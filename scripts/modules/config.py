@@ -1,7 +1,11 @@
 import os
 import re
 import json
+import time
+import threading
 from web3 import Web3
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 
 #region Global Variables
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")) # Go up twice to reach the root directory
@@ -39,6 +43,9 @@ RELAXED_TRUST = int(os.getenv('RELAXED_TRUST'))
 MODERATE_TRUST = int(os.getenv('MODERATE_TRUST'))
 STRICT_TRUST = int(os.getenv('STRICT_TRUST'))
 
+MEMBER_STORAGE = os.getenv('MEMBER_STORAGE', 'field') # 'field' keeps member maps on the group document, 'subcollection' after running migrate_members.py
+BUYBOT_MODE = os.getenv('BUYBOT_MODE', 'poll') # 'poll' checks for buys every MONITOR_INTERVAL, 'websocket' subscribes to pool logs and polls only as a fallback
+
 ETH_ADDRESS_PATTERN = re.compile(r'\b0x[a-fA-F0-9]{40}\b')
 URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
 DOMAIN_PATTERN = re.compile(r'\b[\w\.-]+\.[a-zA-Z]{2,}\b')
@@ -94,31 +101,88 @@ NATIVE_TOKENS = {
 
 WEB3_INSTANCES = {}
 WEB3_WEBSOCKETS = {}
+WEB3_HEALTH = {} # "NETWORK" or "NETWORK (WebSocket)" -> whether the last health check reached it
+WEB3_TIMEOUT = 5 # Seconds per request, a dead endpoint fails fast instead of stalling its caller
+WEB3_HEALTH_INTERVAL = 60 # Seconds between background health checks
 
 CHAINLINK_CONTRACT = None
+
+ABI_NAMES = ['erc20', 'uniswap_v2', 'uniswap_v3', 'chainlink', 'multicall3'] # {name}.abi.json files in the config folder
+ABIS = {}
+CONTRACTS = LRUCache(maxsize=2048) # (chain, lowercase address, abi name) -> contract object
+CONTRACTS_LOCK = threading.Lock()
 #endregion Global Variables
 ##
 #
 ##
+#region ABIs
+def load_abis(): # Parses every ABI once, contract objects built from them are shared through get_contract
+    for name in ABI_NAMES:
+        abi_path = os.path.join(CONFIG_DIR, f"{name}.abi.json")
+        with open(abi_path, "r") as abi_file:
+            ABIS[name] = json.load(abi_file)
+    print(f"Loaded {len(ABIS)} ABIs")
+
+def get_abi(name):
+    if name not in ABIS:
+        load_abis()
+    return ABIS[name]
+
+def get_contract(chain, address, abi_name): # address=None gives an unbound contract, e.g. to decode events from any token
+    key = (chain, address.lower() if address else None, abi_name)
+    with CONTRACTS_LOCK:
+        contract = CONTRACTS.get(key)
+    if contract is not None:
+        return contract
+
+    web3_instance = WEB3_INSTANCES.get(chain)
+    if web3_instance is None:
+        return None
+
+    if address:
+        contract = web3_instance.eth.contract(address=Web3.to_checksum_address(address), abi=get_abi(abi_name))
+    else:
+        contract = web3_instance.eth.contract(abi=get_abi(abi_name))
+    with CONTRACTS_LOCK:
+        return CONTRACTS.setdefault(key, contract)
+#endregion ABIs
+##
+#
+##
 #region Web3 Initialization
-def initialize_web3():
+def initialize_web3(): # Providers connect on their first request, so startup does no network I/O and health is checked in the background
     global WEB3_INSTANCES, WEB3_WEBSOCKETS
 
-    WEB3_INSTANCES = {network: Web3(Web3.HTTPProvider(endpoint)) for network, endpoint in ENDPOINTS.items()}
-    for network, web3_instance in WEB3_INSTANCES.items():
-        if web3_instance.is_connected():
-            print(f"Successfully connected to {network}")
-        else:
-            print(f"Failed to connect to {network}")
-
-    WEB3_WEBSOCKETS = {network: Web3(Web3.LegacyWebSocketProvider(endpoint)) for network, endpoint in WEBSOCKETS.items()}
-    for network, web3_instance in WEB3_WEBSOCKETS.items():
-        if web3_instance.is_connected():
-            print(f"Successfully connected to {network} via WebSocket")
-        else:
-            print(f"Failed to connect to {network} via WebSocket")
+    load_abis()
+
+    WEB3_INSTANCES = {network: Web3(Web3.HTTPProvider(endpoint, request_kwargs={'timeout': WEB3_TIMEOUT})) for network, endpoint in ENDPOINTS.items()}
+    WEB3_WEBSOCKETS = {network: Web3(Web3.LegacyWebSocketProvider(endpoint, websocket_timeout=WEB3_TIMEOUT)) for network, endpoint in WEBSOCKETS.items()}
     
     initialize_chainlink()
+
+    threading.Thread(target=run_health_checks, name="web3-health", daemon=True).start()
+
+def run_health_checks():
+    targets = [(network, web3_instance) for network, web3_instance in WEB3_INSTANCES.items()]
+    targets += [(f"{network} (WebSocket)", web3_instance) for network, web3_instance in WEB3_WEBSOCKETS.items()]
+
+    with ThreadPoolExecutor(max_workers=len(targets) or 1, thread_name_prefix='web3-health') as executor:
+        while True:
+            results = executor.map(check_connection, [web3_instance for _, web3_instance in targets]) # Every endpoint at once, the slowest one sets the pace
+            for (name, _), connected in zip(targets, results):
+                if WEB3_HEALTH.get(name) != connected:
+                    print(f"Successfully connected to {name}" if connected else f"Failed to connect to {name}")
+                WEB3_HEALTH[name] = connected
+            time.sleep(WEB3_HEALTH_INTERVAL)
+
+def check_connection(web3_instance) -> bool:
+    try:
+        return web3_instance.is_connected()
+    except Exception:
+        return False
+
+def is_web3_available(network) -> bool: # Optimistic until the first health check for the network has finished
+    return network in WEB3_INSTANCES and WEB3_HEALTH.get(network, True)
 #endregion Web3 Initialization
 ##
 #
@@ -127,13 +191,5 @@ def initialize_web3():
 def initialize_chainlink():
     global CHAINLINK_CONTRACT
 
-    eth_web3_instance = WEB3_INSTANCES['ETHEREUM']
-    chainlink_eth_usd_address = eth_web3_instance.to_checksum_address('0x5f4ec3df9cbd43714fe2740f5e3616155c5b8419')
-
-    chainlink_abi_path = os.path.join(CONFIG_DIR, "chainlink.abi.json")
-
-    with open(chainlink_abi_path, "r") as abi_file:
-        chainlink_abi = json.load(abi_file)
-        
-    CHAINLINK_CONTRACT = eth_web3_instance.eth.contract(address=chainlink_eth_usd_address, abi=chainlink_abi)
+    CHAINLINK_CONTRACT = get_contract('ETHEREUM', '0x5f4ec3df9cbd43714fe2740f5e3616155c5b8419', 'chainlink')
 #endregion Chainlink
\ No newline at end of file
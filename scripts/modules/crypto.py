@@ -1,22 +1,28 @@
-import os
+import time
 import pytz
-import json
+import asyncio
 import requests
+import threading
 import pandas as pd
 import mplfinance as mpf
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from firebase_admin import firestore
+from web3 import Web3, AsyncWeb3, WebSocketProvider
+from eth_utils.abi import get_abi_output_types
 from apscheduler.schedulers.background import BackgroundScheduler
 
 ## Import the needed modules from the telegram library
-import telegram
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 ## Import the needed modules from the config folder
 # {config.py} - Environment variables and global variables used in the bot
 # {utils.py} - Utility functions and variables used in the bot
 # {firebase.py} - Firebase configuration and database initialization
+# {outbound.py} - Rate shaped outbound message queue
 from modules import config, utils, firebase
+from modules.outbound import outbound
 ##
 
 #region Crypto Logic
@@ -93,7 +99,179 @@ def plot_candlestick_chart(data_frame, group_id):
 #
 #region Buybot
 MONITOR_INTERVAL = 20 # Interval for monitoring jobs (seconds)
+MAX_BLOCK_RANGE = 2000 # Largest block range requested in a single get_logs call, longer gaps are caught up in chunks
+MIN_BLOCK_RANGE = 10 # A get_logs call that times out or is rejected is retried with half the range, down to this
+INITIAL_LOOKBACK = 100 # Blocks scanned the first time a pool is watched
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef' # keccak256("Transfer(address,address,uint256)")
+WEBSOCKET_SAFETY_INTERVAL = 120 # While a chain's log subscription is live, polling only runs this often to catch anything it missed
+WEBSOCKET_MAX_BACKOFF = 60 # Seconds, reconnect delay doubles up to this
+CURSOR_PERSIST_INTERVAL = 300 # Seconds between writes of cursors for pools without buys, a restart re-scans at most this much of them
 scheduler = BackgroundScheduler()
+watched_pools = {} # (chain, lowercase liquidity_address) -> {group_id: group_data}, polled together per chain
+watched_pools_lock = threading.Lock()
+monitor_locks = {} # chain -> Lock, a pushed poll and the interval job never scan the same chain at once
+block_ranges = {} # chain -> get_logs block range currently used, shrinks when the provider can't keep up and grows back on success
+last_polled = {} # chain -> time of the last scan
+rescan_requests = set() # Chains with a push that no scan has picked up yet, a running scan loops until this is clear
+rescan_lock = threading.Lock()
+subscriptions = {} # chain -> LogSubscription, only in websocket mode
+
+class BlockCursors: # Last processed block per (chain, pool), persisted to Firestore so a restart resumes where it stopped
+    def __init__(self, collection='block_cursors', persist_interval=CURSOR_PERSIST_INTERVAL):
+        self.collection = collection
+        self.persist_interval = persist_interval
+        self.blocks = {} # In-memory cursors are authoritative, Firestore only lags behind them
+        self.persisted = {} # (chain, pool) -> block last written to Firestore
+        self.persisted_at = {} # chain -> time quiet pools were last written
+        self.lock = threading.Lock()
+
+    def document(self, chain, pool):
+        return firebase.DATABASE.collection(self.collection).document(f"{chain}_{pool}")
+
+    def get(self, chain, pool) -> int | None:
+        key = (chain, pool.lower())
+        with self.lock:
+            if key in self.blocks:
+                return self.blocks[key]
+
+        block = None
+        try:
+            snapshot = self.document(*key).get()
+            if snapshot.exists:
+                block = snapshot.to_dict().get('block')
+        except Exception as e:
+            print(f"Failed to load block cursor for {pool} on {chain}: {e}")
+
+        with self.lock:
+            self.persisted.setdefault(key, block)
+            return self.blocks.setdefault(key, block)
+
+    def advance(self, chain, pools, block, alerted=()): # Moves every given pool to block, pools that alerted are persisted now and the rest every persist_interval
+        alerted = {pool.lower() for pool in alerted} # Re-scanning these after a restart would repeat their alerts
+        current_time = time.time()
+        with self.lock:
+            for pool in pools:
+                self.blocks[(chain, pool.lower())] = block
+
+            persist_all = current_time - self.persisted_at.get(chain, 0) >= self.persist_interval
+            if persist_all:
+                self.persisted_at[chain] = current_time
+            keys = [
+                key for key, cursor in self.blocks.items()
+                if key[0] == chain and cursor != self.persisted.get(key) and (persist_all or key[1] in alerted)
+            ]
+            for key in keys:
+                self.persisted[key] = self.blocks[key]
+        if not keys:
+            return
+
+        try:
+            for start in range(0, len(keys), 500): # Firestore batch limit
+                batch = firebase.DATABASE.batch()
+                for key in keys[start:start + 500]:
+                    batch.set(self.document(*key), {
+                        'chain': chain,
+                        'pool': key[1],
+                        'block': self.blocks[key],
+                        'updated_at': firestore.SERVER_TIMESTAMP
+                    })
+                batch.commit()
+        except Exception as e: # The in-memory cursors still move on, a restart re-scans from the last persisted blocks
+            print(f"Failed to persist block cursors on {chain}: {e}")
+            with self.lock:
+                for key in keys:
+                    self.persisted.pop(key, None) # Written again on the next advance
+
+block_cursors = BlockCursors()
+
+class LogSubscription: # Websocket logs subscription for one chain, every notification triggers an immediate scan of that chain
+    def __init__(self, chain, endpoint):
+        self.chain = chain
+        self.endpoint = endpoint
+        self.connected = False
+        self.stopped = False
+        self.loop = None
+        self.task = None
+        self.backoff = 1
+        self.thread = threading.Thread(target=self._run, name=f"logs-{chain}", daemon=True)
+        self.thread.start()
+
+    def refresh(self): # Resubscribe with the current set of watched pools
+        if self.loop is not None and self.task is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+
+    def stop(self):
+        self.stopped = True
+        self.refresh()
+
+    def _run(self):
+        asyncio.run(self._listen_forever())
+
+    async def _listen_forever(self):
+        self.loop = asyncio.get_running_loop()
+        while not self.stopped:
+            self.task = asyncio.ensure_future(self._listen())
+            try:
+                await self.task
+            except asyncio.CancelledError: # Watched pools changed or stop() was called
+                continue
+            except Exception as e:
+                print(f"Log subscription on {self.chain} dropped, polling until it reconnects: {e}")
+
+            await asyncio.sleep(self.backoff)
+            self.backoff = min(self.backoff * 2, WEBSOCKET_MAX_BACKOFF)
+
+    async def _listen(self):
+        _, token_addresses, pool_topics = transfer_filter(watched_chain_pools(self.chain))
+        if not token_addresses:
+            return
+
+        try:
+            async with AsyncWeb3(WebSocketProvider(self.endpoint)) as web3_socket:
+                await web3_socket.eth.subscribe('logs', {
+                    'address': token_addresses,
+                    'topics': [TRANSFER_TOPIC, pool_topics]
+                })
+                self.connected = True
+                self.backoff = 1
+                print(f"Subscribed to Transfer logs for {len(pool_topics)} pools on {self.chain} via WebSocket")
+
+                async for _ in web3_socket.socket.process_subscriptions():
+                    request_scan(self.chain)
+        finally:
+            self.connected = False
+
+def request_scan(chain): # Runs monitor_transfers for the chain right away, pushes that arrive before a scan starts are coalesced into it
+    with rescan_lock:
+        if chain in rescan_requests: # A queued or running scan will see this push
+            return
+        rescan_requests.add(chain)
+
+    scheduler.add_job( # Skipped by APScheduler while a push scan is still running, that scan loops on rescan_requests instead
+        monitor_transfers,
+        args=[chain, True],
+        id=f"push_{chain}",
+        replace_existing=True,
+        timezone=pytz.utc
+    )
+
+def update_log_subscription(chain): # Starts, refreshes or stops the chain's subscription to match its watched pools
+    if config.BUYBOT_MODE != 'websocket':
+        return
+
+    endpoint = config.WEBSOCKETS.get(chain)
+    subscription = subscriptions.get(chain)
+    if not watched_chain_pools(chain):
+        if subscription is not None:
+            subscription.stop()
+            del subscriptions[chain]
+    elif subscription is not None:
+        subscription.refresh()
+    elif endpoint:
+        subscriptions[chain] = LogSubscription(chain, endpoint)
+    else:
+        print(f"No WebSocket endpoint for {chain}, buybot keeps polling.")
+
 def start_monitoring_groups():
     groups_snapshot = firebase.DATABASE.collection('groups').get()
     for group_doc in groups_snapshot:
@@ -109,79 +287,179 @@ def start_monitoring_groups():
 
 def schedule_group_monitoring(group_data):
     group_id = str(group_data['group_id'])
-    job_id = f"monitoring_{group_id}"
     token_info = group_data.get('token')
 
     if token_info:
         chain = token_info.get('chain')
-        liquidity_address = token_info.get('liquidity_address')
-        web3_instance = config.WEB3_INSTANCES.get(chain)
-
-        if web3_instance and web3_instance.is_connected():
-            existing_job = scheduler.get_job(job_id)  # Check for existing job with ID
-            if existing_job:
-                existing_job.remove()  # Remove existing job to update with new information
-
-            scheduler.add_job(
-                monitor_transfers,
-                'interval',
-                seconds=MONITOR_INTERVAL,
-                args=[web3_instance, liquidity_address, group_data],
-                id=job_id,  # Unique ID for the job
-                timezone=pytz.utc  # Use the UTC timezone from the pytz library
-            )
+        if config.is_web3_available(chain):
+            unschedule_group_monitoring(group_id) # The group may have switched to another pool
+
+            if not valid_monitoring_addresses(token_info): # One half-configured group must not break the shared scan for its chain
+                print(f"Group {group_id} has a missing or invalid contract or liquidity address - Not scheduling monitoring.")
+                return
+
+            job_id = f"monitoring_{chain}"
+            with watched_pools_lock:
+                watched_pools.setdefault((chain, token_info['liquidity_address'].lower()), {})[group_id] = group_data
+
+            if scheduler.get_job(job_id) is None: # One poller per chain covers every watched pool on it
+                scheduler.add_job(
+                    monitor_transfers,
+                    'interval',
+                    seconds=MONITOR_INTERVAL,
+                    args=[chain],
+                    id=job_id,  # Unique ID for the job
+                    timezone=pytz.utc  # Use the UTC timezone from the pytz library
+                )
+            update_log_subscription(chain)
             print(f"Scheduled monitoring for premium group {group_id}")
         else:
             print(f"Web3 instance not connected for group {group_id} on chain {chain}")
     else:
         print(f"No token info found for group {group_id} - Not scheduling monitoring.")
 
-def monitor_transfers(web3_instance, liquidity_address, group_data):
-    abi_path = os.path.join(config.CONFIG_DIR, 'erc20.abi.json')
-
-    with open(abi_path, 'r') as abi_file:
-        abi = json.load(abi_file)
-    
-    contract_address = group_data['token']['contract_address']
-    
-    contract = web3_instance.eth.contract(address=contract_address, abi=abi)
+def valid_monitoring_addresses(token_info) -> bool:
+    try:
+        Web3.to_checksum_address(token_info.get('contract_address'))
+        Web3.to_checksum_address(token_info.get('liquidity_address'))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def unschedule_group_monitoring(group_id):
+    changed_chains = set()
+    with watched_pools_lock:
+        for (chain, pool), subscribers in list(watched_pools.items()):
+            if subscribers.pop(group_id, None) is None or subscribers:
+                continue
+
+            del watched_pools[(chain, pool)] # Last group on this pool
+            changed_chains.add(chain)
+            if not any(watched_chain == chain for watched_chain, _ in watched_pools):
+                existing_job = scheduler.get_job(f"monitoring_{chain}")
+                if existing_job:
+                    existing_job.remove()
+
+    for chain in changed_chains:
+        update_log_subscription(chain)
+
+def watched_chain_pools(chain) -> dict: # pool -> groups watching it, for one chain
+    with watched_pools_lock:
+        return {pool: list(subscribers.values()) for (watched_chain, pool), subscribers in watched_pools.items() if watched_chain == chain}
+
+def transfer_filter(pools: dict) -> tuple: # Log filter for Transfers out of the watched pools, plus how to route each log back to its pool
+    routes = {} # (token address, pool) -> pool, a log only counts for the token the pool's groups are set up with
+    token_addresses = set()
+    for pool, subscribers in pools.items():
+        token_address = Web3.to_checksum_address(subscribers[0]['token']['contract_address'])
+        routes[(token_address.lower(), pool)] = pool
+        token_addresses.add(token_address)
+    pool_topics = ['0x' + '0' * 24 + pool[2:] for pool in pools] # Indexed "from" address, left padded to 32 bytes
+    return routes, sorted(token_addresses), pool_topics
+
+def monitor_transfers(chain, pushed=False):
+    subscription = subscriptions.get(chain)
+    if not pushed and subscription is not None and subscription.connected and time.time() - last_polled.get(chain, 0) < WEBSOCKET_SAFETY_INTERVAL:
+        return # The log subscription triggers scans, this job is only a safety net while it is live
+
+    with monitor_locks.setdefault(chain, threading.Lock()):
+        with rescan_lock:
+            if pushed and chain not in rescan_requests: # Another scan already picked up this push while we waited for the lock
+                return
+
+        while True:
+            with rescan_lock:
+                rescan_requests.discard(chain) # Pushes from here on need another pass
+            last_polled[chain] = time.time()
+            scan_transfers(chain)
+
+            with rescan_lock:
+                if chain not in rescan_requests:
+                    return
+            print(f"Logs were pushed on {chain} during the scan, scanning again.")
+
+def scan_transfers(chain): # One eth_getLogs per chain and block range for all watched pools, events fan out to the groups
+    pools = watched_chain_pools(chain)
+    if not pools:
+        return
 
-    # Initialize static tracking of the last seen block
-    if not hasattr(monitor_transfers, "last_seen_block"):
-        lookback_range = 100 # Check the last block on boot
-        monitor_transfers.last_seen_block = web3_instance.eth.block_number - lookback_range
+    web3_instance = config.WEB3_INSTANCES.get(chain)
 
-    last_seen_block = monitor_transfers.last_seen_block
-    latest_block = web3_instance.eth.block_number
+    try:
+        transfer_event = config.get_contract(chain, None, 'erc20').events.Transfer() # Decodes Transfer logs from any token
+        routes, token_addresses, pool_topics = transfer_filter(pools)
+
+        latest_block = web3_instance.eth.block_number
+        cursors = {}
+        for pool in pools:
+            cursor = block_cursors.get(chain, pool)
+            cursors[pool] = latest_block - INITIAL_LOOKBACK if cursor is None else cursor # None the first time a pool is watched
+
+        last_seen_block = min(cursors.values())
+        if last_seen_block >= latest_block:
+            print(f"No new blocks to process on {chain}.")
+            return  # Exit if no new blocks
+
+        block_range = block_ranges.get(chain, MAX_BLOCK_RANGE)
+        while last_seen_block < latest_block:
+            to_block = min(latest_block, last_seen_block + block_range)
+            print(f"Processing blocks {last_seen_block + 1} to {to_block} for {len(pools)} pools on {chain}")
+
+            try:
+                logs = web3_instance.eth.get_logs({ # Transfers out of any watched pool, for any watched token
+                    'fromBlock': last_seen_block + 1,
+                    'toBlock': to_block,
+                    'address': token_addresses,
+                    'topics': [TRANSFER_TOPIC, pool_topics]
+                })
+            except Exception as e: # Wide ranges can exceed the request timeout or the provider's result limit
+                if block_range <= MIN_BLOCK_RANGE:
+                    raise
+                block_range = block_ranges[chain] = max(MIN_BLOCK_RANGE, block_range // 2)
+                print(f"get_logs failed on {chain} ({e}), retrying with a range of {block_range} blocks.")
+                continue
+
+            events = {} # pool -> decoded Transfer events in this range
+            for log in logs:
+                sender = '0x' + bytes(log['topics'][1])[-20:].hex()
+                pool = routes.get((log['address'].lower(), sender))
+                if pool is None or log['blockNumber'] <= cursors[pool]: # Another pool's token, or already processed for this pool
+                    continue
+
+                events.setdefault(pool, []).append(transfer_event.process_log(log))
+
+            prices = fetch_prices([(chain, pool) for pool in events]) # Every pool with buys is priced concurrently
+            for pool, pool_events in events.items():
+                handle_transfer_events(chain, pool, pool_events, pools[pool], prices[(chain, pool)])
+
+            behind = [pool for pool, cursor in cursors.items() if cursor < to_block]
+            block_cursors.advance(chain, behind, to_block, alerted=events)
+            for pool in behind:
+                cursors[pool] = to_block
+            last_seen_block = to_block
+
+            if block_range < MAX_BLOCK_RANGE: # Grow back gradually so a recovered provider catches up in wider chunks again
+                block_range = block_ranges[chain] = min(MAX_BLOCK_RANGE, block_range + max(1, block_range // 4))
 
-    if last_seen_block >= latest_block:
-        print(f"No new blocks to process for group {group_data['group_id']}.")
-        return  # Exit if no new blocks
+    except Exception as e:
+        print(f"Error during transfer monitoring on {chain}: {e}")
 
-    print(f"Processing blocks {last_seen_block + 1} to {latest_block} for group {group_data['group_id']}")
+MAX_DIGEST_LINES = 20 # Buys listed in one digest, the rest only count towards its totals
 
-    try:
-        logs = contract.events.Transfer().get_logs( # Fetch Transfer events in the specified block range
-            from_block=last_seen_block + 1,
-            to_block=latest_block,
-            argument_filters={'from': liquidity_address}
-        )
-
-        for log in logs: # Process each log
-            handle_transfer_event(log, group_data)  # Pass the decoded log to your handler
+def handle_transfer_events(chain, lp_address, events, subscribers, token_price_in_usd): # One price for every buy in the scanned range, then alerts each group
+    print(f"Received {len(events)} transfer events for pool {lp_address} on {chain}.")
+    if token_price_in_usd is None:
+        print("Failed to fetch token price in USD.")
+        return
 
-        monitor_transfers.last_seen_block = latest_block # Update static last_seen_block
+    for group_data in subscribers:
+        try:
+            send_buy_alerts(events, group_data, Decimal(token_price_in_usd))
+        except Exception as e:
+            print(f"Error handling transfer events for group {group_data['group_id']}: {e}")
 
-    except Exception as e:
-        print(f"Error during transfer monitoring for group {group_data['group_id']}: {e}")
-
-def handle_transfer_event(event, group_data):
-    fetched_data, group_doc = utils.fetch_group_info(
-        update=None,  # No update object is available in this context
-        context=None,  # No context object is used here
-        return_both=True,
-        group_id=group_data['group_id']
-    )
+def send_buy_alerts(events, group_data, token_price_in_usd):
+    fetched_data = utils.fetch_group_info(None, None, group_id=group_data['group_id']) # Current buybot settings
 
     if fetched_data is None:
         print(f"Failed to fetch group data for group ID {group_data['group_id']}.")
@@ -191,35 +469,37 @@ def handle_transfer_event(event, group_data):
     minimum_buy_amount = buybot_config.get('minimumbuy', 1000)  # Default to 1000 if not set
     small_buy_amount = buybot_config.get('smallbuy', 2500)  # Default to 2500 if not set
     medium_buy_amount = buybot_config.get('mediumbuy', 5000) # Default to 5000
-
-    amount = event['args']['value']
-    tx_hash = event['transactionHash'].hex()
-
-    if not tx_hash.startswith("0x"):
-        tx_hash = "0x" + tx_hash
+    digest_buy_amount = buybot_config.get('digestbuy', medium_buy_amount) # Several buys in one scan below this share a digest, 0 alerts every buy
 
     decimals = group_data['token'].get('decimals', 18)  # Convert amount to token decimal
-    token_amount = Decimal(amount) / (10 ** decimals)
-
-    print(f"Received transfer event for {token_amount} tokens.")
-    print(f"Transaction hash: {tx_hash}")
-    
-    chain = group_data['token']['chain'] # Fetch the USD price of the token using Uniswap V3 and Chainlink1
-    lp_address = group_data['token']['liquidity_address']
-    token_price_in_usd = get_token_price_in_usd(chain, lp_address)
+    buys = []
+    for event in events:
+        tx_hash = event['transactionHash'].hex()
+        if not tx_hash.startswith("0x"):
+            tx_hash = "0x" + tx_hash
 
-    if token_price_in_usd is not None:
-        token_price_in_usd = Decimal(token_price_in_usd)
+        token_amount = Decimal(event['args']['value']) / (10 ** decimals)
         total_value_usd = token_amount * token_price_in_usd
         if total_value_usd < minimum_buy_amount:
             print(f"Ignoring small buy below the minimum threshold: ${total_value_usd:.2f}")
-            return  # Ignore small buy events
-        value_message = f" (${total_value_usd:.2f})"
-        header_emoji, buyer_emoji = categorize_buyer(total_value_usd, small_buy_amount, medium_buy_amount)
-    else:
-        print("Failed to fetch token price in USD.")
-        return
+            continue  # Ignore small buy events
+        buys.append((token_amount, total_value_usd, tx_hash))
+
+    if len(buys) > 1 and digest_buy_amount > 0:
+        digest_buys = [buy for buy in buys if buy[1] < digest_buy_amount]
+        if len(digest_buys) > 1:
+            send_buy_digest(digest_buys, group_data, small_buy_amount, medium_buy_amount)
+            buys = [buy for buy in buys if buy[1] >= digest_buy_amount]
+
+    for token_amount, total_value_usd, tx_hash in buys:
+        send_buy_alert(token_amount, total_value_usd, tx_hash, group_data, small_buy_amount, medium_buy_amount)
+
+def send_buy_alert(token_amount, total_value_usd, tx_hash, group_data, small_buy_amount, medium_buy_amount):
+    print(f"Transaction hash: {tx_hash}")
+    value_message = f" (${total_value_usd:.2f})"
+    header_emoji, buyer_emoji = categorize_buyer(total_value_usd, small_buy_amount, medium_buy_amount)
 
+    chain = group_data['token']['chain']
     token_name = group_data['token'].get('symbol', 'TOKEN')
     blockscanner = config.BLOCKSCANNERS.get(chain.upper())
     
@@ -243,6 +523,32 @@ def handle_transfer_event(event, group_data):
         print(f"Sending fallback buy message for group {group_data['group_id']}")
         send_buy_message(message, group_data['group_id'])
 
+def send_buy_digest(buys, group_data, small_buy_amount, medium_buy_amount): # One message for a burst of buys, largest first
+    buys = sorted(buys, key=lambda buy: buy[1], reverse=True)
+    header_emoji, _ = categorize_buyer(buys[0][1], small_buy_amount, medium_buy_amount)
+
+    chain = group_data['token']['chain']
+    token_name = group_data['token'].get('symbol', 'TOKEN')
+    blockscanner = config.BLOCKSCANNERS.get(chain.upper())
+
+    lines = []
+    for token_amount, total_value_usd, tx_hash in buys[:MAX_DIGEST_LINES]:
+        _, buyer_emoji = categorize_buyer(total_value_usd, small_buy_amount, medium_buy_amount)
+        line = f"{buyer_emoji} {token_amount:,.4f} {token_name} (${total_value_usd:.2f})"
+        lines.append(f"[{line}](https://{blockscanner}/tx/{tx_hash})" if blockscanner else line)
+    if len(buys) > MAX_DIGEST_LINES:
+        lines.append(f"...and {len(buys) - MAX_DIGEST_LINES} more")
+
+    total_tokens = sum(buy[0] for buy in buys)
+    total_value_usd = sum(buy[1] for buy in buys)
+    message = (
+        f"{header_emoji} {len(buys)} BUYS {header_emoji}\n\n"
+        + "\n".join(lines)
+        + f"\n\nTotal: {total_tokens:,.4f} {token_name} (${total_value_usd:.2f})"
+    )
+    print(f"Sending buy digest of {len(buys)} buys for group {group_data['group_id']}")
+    send_buy_message(message, group_data['group_id'])
+
 def categorize_buyer(usd_value, small_buy, medium_buy):
     if usd_value < small_buy:
         return "💸", "🐟"
@@ -251,57 +557,102 @@ def categorize_buyer(usd_value, small_buy, medium_buy):
     else:
         return "🤑", "🐳"
     
-def send_buy_message(text, group_id, reply_markup=None):
-    msg = None
-    bot = telegram.Bot(token=config.TELEGRAM_TOKEN)
-    group_data = utils.fetch_group_info(None, None, group_id)
+def send_buy_message(text, group_id, reply_markup=None): # Queued, the outbound workers deliver it and track the sent message
+    group_data = utils.fetch_group_info(None, None, group_id=group_id)
     
     if not utils.rate_limit_check(group_id):
-        msg = bot.send_message(chat_id=group_id, text="Bot rate limit exceeded. Please try again later.")
+        outbound.send(group_id, text="Bot rate limit exceeded. Please try again later.", on_sent=utils.track_message)
         return
     
-    try:
-        if group_data and group_data.get('premium') and group_data.get('premium_features', {}).get('buybot_header'):
-            buybot_header_url = group_data['premium_features'].get('buybot_header_url')
-
-            if not buybot_header_url:
-                print(f"No buybot header URL found for group {group_id}. Sending message without media.")
+    buybot_header_url = None
+    if group_data and group_data.get('premium') and group_data.get('premium_features', {}).get('buybot_header'):
+        buybot_header_url = group_data['premium_features'].get('buybot_header_url')
 
+        if not buybot_header_url:
+            print(f"No buybot header URL found for group {group_id}. Sending message without media.")
+        else:
             print(f"Group {group_id} has premium features enabled, and has a buybot header uploaded... Determining media type.")
             
-            if buybot_header_url.endswith('.gif') or buybot_header_url.endswith('.mp4'):
-                msg = bot.send_animation(
-                    chat_id=group_id,
-                    animation=buybot_header_url,
-                    caption=text,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-                print(f"Sending buybot message as animation for group {group_id}.")
-            else:
-                msg = bot.send_photo(
-                    chat_id=group_id,
-                    photo=buybot_header_url,
-                    caption=text,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-                print(f"Sending buybot message as photo for group {group_id}.")
-        else: # Default behavior: send as text-only message
-            print(f"Group {group_id} does not have premium features or buybot header enabled. Sending message without media.")
-            msg = bot.send_message(
-                chat_id=group_id,
-                text=text,
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-    except Exception as e:
-        print(f"Error sending message: {e}")
-
-    if msg is not None:
-        utils.track_message(msg)
+    if buybot_header_url and (buybot_header_url.endswith('.gif') or buybot_header_url.endswith('.mp4')):
+        outbound.send(
+            group_id,
+            'send_animation',
+            on_sent=utils.track_message,
+            animation=buybot_header_url,
+            caption=text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+        print(f"Queued buybot message as animation for group {group_id}.")
+    elif buybot_header_url:
+        outbound.send(
+            group_id,
+            'send_photo',
+            on_sent=utils.track_message,
+            photo=buybot_header_url,
+            caption=text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+        print(f"Queued buybot message as photo for group {group_id}.")
+    else: # Default behavior: send as text-only message
+        print(f"Group {group_id} does not have premium features or buybot header enabled. Sending message without media.")
+        outbound.send(
+            group_id,
+            on_sent=utils.track_message,
+            text=text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
 #endregion Buybot
 #
+#region Multicall
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11' # Same address on every supported chain
+multicall_deployed = {} # chain -> whether Multicall3 has code there, checked once per chain
+
+def multicall(chain, calls: list) -> list: # Runs contract reads (e.g. contract.functions.decimals()) in one eth_call, results in order with None for failed reads
+    web3_instance = config.WEB3_INSTANCES.get(chain)
+    if web3_instance is None:
+        print(f"Web3 instance for chain {chain} not found or not connected.")
+        return [None] * len(calls)
+
+    if len(calls) > 1 and is_multicall_deployed(chain, web3_instance):
+        try:
+            multicall_contract = config.get_contract(chain, MULTICALL3_ADDRESS, 'multicall3')
+            results = multicall_contract.functions.aggregate3(
+                [(call.address, True, call._encode_transaction_data()) for call in calls] # allowFailure, one bad read does not sink the batch
+            ).call()
+            return [decode_multicall_result(web3_instance, call, success, data) for call, (success, data) in zip(calls, results)]
+        except Exception as e:
+            print(f"Multicall on {chain} failed, falling back to individual calls: {e}")
+
+    return [call_or_none(call) for call in calls]
+
+def is_multicall_deployed(chain, web3_instance) -> bool:
+    if chain not in multicall_deployed:
+        try:
+            multicall_deployed[chain] = len(web3_instance.eth.get_code(MULTICALL3_ADDRESS)) > 0
+        except Exception as e: # Not cached, checked again next time
+            print(f"Failed to check for Multicall3 on {chain}: {e}")
+            return False
+    return multicall_deployed[chain]
+
+def decode_multicall_result(web3_instance, call, success, data):
+    if not success or not data:
+        print(f"Multicall read {call.fn_name} on {call.address} failed.")
+        return None
+
+    values = web3_instance.codec.decode(get_abi_output_types(call.abi), data)
+    return values[0] if len(values) == 1 else list(values) # Same shape as call.call()
+
+def call_or_none(call):
+    try:
+        return call.call()
+    except Exception as e:
+        print(f"Read {call.fn_name} on {call.address} failed: {e}")
+        return None
+#endregion Multicall
+#
 #region Price Fetching
 def get_token_price_in_usd(chain, lp_address):
     try:
@@ -328,58 +679,152 @@ def get_token_price_in_usd(chain, lp_address):
         print(f"Error fetching token price in USD: {e}")
         return None
     
+ETH_PRICE_TTL = 15 # Seconds an ETH/USD answer is served without asking Chainlink again
+ETH_PRICE_MAX_STALE = 300 # Seconds the last answer may still be served while Chainlink cannot be reached
+
+class EthPriceCache: # Chainlink only posts a new round on its heartbeat or a price deviation, so most reads would return the same answer
+    def __init__(self, ttl=ETH_PRICE_TTL, max_stale=ETH_PRICE_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.price = None
+        self.round_id = None
+        self.fetched_at = 0.0
+        self.refresh_lock = threading.Lock() # Single flight, concurrent callers wait for one refresh instead of each calling Chainlink
+
+    def get(self):
+        if self.price is not None and time.time() - self.fetched_at < self.ttl:
+            return self.price
+
+        with self.refresh_lock:
+            if self.price is not None and time.time() - self.fetched_at < self.ttl: # Refreshed while we waited
+                return self.price
+
+            try:
+                latest_round_data = config.CHAINLINK_CONTRACT.functions.latestRoundData().call()
+            except Exception as e:
+                print(f"Failed to get ETH price: {e}")
+                if self.price is not None and time.time() - self.fetched_at < self.max_stale:
+                    return self.price
+                return None
+
+            round_id = latest_round_data[0]
+            if self.round_id is None or round_id > self.round_id: # An RPC node lagging behind can answer with an older round, keep the newer one
+                self.round_id = round_id
+                self.price = latest_round_data[1] / 10 ** 8
+                print(f"ETH price: ${self.price} (round {round_id})")
+            self.fetched_at = time.time()
+            return self.price
+
+eth_price_cache = EthPriceCache()
+
 def check_eth_price():
-    try:
-        latest_round_data = config.CHAINLINK_CONTRACT.functions.latestRoundData().call()
-        price = latest_round_data[1] / 10 ** 8
-        print(f"ETH price: ${price}")
-        return price
-    except Exception as e:
-        print(f"Failed to get ETH price: {e}")
+    return eth_price_cache.get()
+
+class PoolMetadataCache: # Immutable pool facts per (chain, pool), kept in memory and in the pools collection so they are only read from chain once
+    def __init__(self, collection='pools'):
+        self.collection = collection
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def document(self, chain, pool):
+        return firebase.DATABASE.collection(self.collection).document(f"{chain}_{pool}")
+
+    def get(self, chain, lp_address) -> dict | None:
+        key = (chain, lp_address.lower())
+        with self.lock:
+            metadata = self.pools.get(key)
+        if metadata is not None:
+            return metadata
+
+        try:
+            snapshot = self.document(*key).get()
+            metadata = snapshot.to_dict() if snapshot.exists else None
+        except Exception as e:
+            print(f"Failed to load pool metadata for {lp_address} on {chain}: {e}")
+
+        if metadata is None:
+            metadata = probe_pool_metadata(chain, lp_address)
+            if metadata is None:
+                return None # Not cached, the next call probes again
+
+            try:
+                self.document(*key).set(metadata)
+            except Exception as e:
+                print(f"Failed to persist pool metadata for {lp_address} on {chain}: {e}")
+
+        with self.lock:
+            return self.pools.setdefault(key, metadata)
+
+pool_metadata = PoolMetadataCache()
+
+def probe_pool_metadata(chain, lp_address) -> dict | None: # Pool type, both tokens and their decimals, read from chain
+    web3_instance = config.WEB3_INSTANCES.get(chain)
+    if not web3_instance:
+        print(f"Web3 instance for chain {chain} not found or not connected.")
+        return None
+
+    pool_type = probe_pool_type(chain, lp_address)
+    if pool_type is None:
         return None
 
-def determine_pool_type(chain, lp_address):
     try:
-        web3_instance = config.WEB3_INSTANCES.get(chain)
-        if not web3_instance:
-            print(f"Web3 instance for chain {chain} not found or not connected.")
+        pair_contract = config.get_contract(chain, lp_address, f'uniswap_{pool_type}')
+
+        token0_address, token1_address = multicall(chain, [pair_contract.functions.token0(), pair_contract.functions.token1()])
+        if token0_address is None or token1_address is None:
             return None
-        
-        abi_path = os.path.join(config.CONFIG_DIR, 'uniswap_v3.abi.json')
-        with open(abi_path, 'r') as abi_file:
-            abi = json.load(abi_file)
 
-        address = web3_instance.to_checksum_address(lp_address)
+        token0_contract = config.get_contract(chain, token0_address, 'erc20')
+        token1_contract = config.get_contract(chain, token1_address, 'erc20')
+        decimals0, decimals1 = multicall(chain, [token0_contract.functions.decimals(), token1_contract.functions.decimals()])
+        if decimals0 is None or decimals1 is None:
+            return None
+    except Exception as e:
+        print(f"Error fetching Uniswap {pool_type} pool tokens: {e}")
+        return None
 
-        pair_contract = web3_instance.eth.contract(address=address, abi=abi)
+    print(f"Pool {lp_address} on {chain} is a Uniswap {pool_type.upper()} pool. Token0 decimals: {decimals0}, Token1 decimals: {decimals1}")
+    return {
+        'chain': chain,
+        'pool': lp_address.lower(),
+        'pool_type': pool_type,
+        'token0': token0_address,
+        'token1': token1_address,
+        'decimals0': decimals0,
+        'decimals1': decimals1
+    }
 
+def probe_pool_type(chain, lp_address):
+    try:
+        pair_contract = config.get_contract(chain, lp_address, 'uniswap_v3')
         pair_contract.functions.slot0().call() # Attempt to call the slot0 function
-        print("Pool is a Uniswap V3 pool.")
         return "v3"
     except Exception as e:
         if "execution reverted" in str(e) or "no data" in str(e):
-            print("Pool is a Uniswap V2 pool.")
             return "v2"
         print(f"Error determining pool type: {e}")
         return None
+
+def determine_pool_type(chain, lp_address):
+    metadata = pool_metadata.get(chain, lp_address)
+    return metadata['pool_type'] if metadata else None
     
-def get_uniswap_position_data(chain, lp_address, pool_type):
+def get_uniswap_position_data(chain, lp_address, pool_type): # One getReserves or slot0 call, everything else comes from the pool metadata cache
     try:
         web3_instance = config.WEB3_INSTANCES.get(chain)
         if not web3_instance:
             print(f"Web3 instance for chain {chain} not found or not connected.")
             return None
 
-        abi_path = os.path.join(config.CONFIG_DIR, f'uniswap_{pool_type}.abi.json')
-        with open(abi_path, 'r') as abi_file:
-            abi = json.load(abi_file)
-
-        address = web3_instance.to_checksum_address(lp_address)
-        pair_contract = web3_instance.eth.contract(address=address, abi=abi)
+        metadata = pool_metadata.get(chain, lp_address)
+        if metadata is None:
+            return None
+        token0_address = metadata['token0']
+        token1_address = metadata['token1']
+        decimals0 = metadata['decimals0']
+        decimals1 = metadata['decimals1']
 
-        erc20_abi_path = os.path.join(config.CONFIG_DIR, 'erc20.abi.json')
-        with open(erc20_abi_path, 'r') as erc20_abi_file:
-            erc20_abi = json.load(erc20_abi_file)
+        pair_contract = config.get_contract(chain, lp_address, f'uniswap_{pool_type}')
 
         if pool_type == "v2":
             reserves = pair_contract.functions.getReserves().call()
@@ -387,16 +832,6 @@ def get_uniswap_position_data(chain, lp_address, pool_type):
             reserve1 = Decimal(reserves[1])
             print(f"Raw reserves: reserve0={reserve0}, reserve1={reserve1}")
 
-            token0_address = pair_contract.functions.token0().call()
-            token1_address = pair_contract.functions.token1().call()
-
-            token0_contract = web3_instance.eth.contract(address=token0_address, abi=erc20_abi)
-            token1_contract = web3_instance.eth.contract(address=token1_address, abi=erc20_abi)
-            decimals0 = token0_contract.functions.decimals().call()
-            decimals1 = token1_contract.functions.decimals().call()
-
-            print(f"Token0 decimals: {decimals0}, Token1 decimals: {decimals1}")
-
             weth_address = config.WETH_ADDRESSES.get(chain).lower()
             print(f"WETH address on {chain}: {weth_address}")
 
@@ -421,16 +856,6 @@ def get_uniswap_position_data(chain, lp_address, pool_type):
             sqrt_price_x96 = slot0[0]
             print(f"Raw sqrtPriceX96: {sqrt_price_x96}")
 
-            token0_address = pair_contract.functions.token0().call()
-            token1_address = pair_contract.functions.token1().call()
-
-            token0_contract = web3_instance.eth.contract(address=token0_address, abi=erc20_abi)
-            token1_contract = web3_instance.eth.contract(address=token1_address, abi=erc20_abi)
-            decimals0 = token0_contract.functions.decimals().call()
-            decimals1 = token1_contract.functions.decimals().call()
-
-            print(f"Token0 decimals: {decimals0}, Token1 decimals: {decimals1}")
-
             sqrt_price_x96_decimal = Decimal(sqrt_price_x96) # Adjust sqrtPriceX96 for price calculation
             price_in_weth = (sqrt_price_x96_decimal ** 2) / Decimal(2 ** 192)
 
@@ -452,6 +877,54 @@ def get_uniswap_position_data(chain, lp_address, pool_type):
         print(f"Error fetching Uniswap {pool_type} reserves: {e}")
         return None
 #endregion Price Fetching
+#
+#region Price Service
+PRICE_WORKERS = 8 # Concurrent price lookups across all chains
+PRICE_TIMEOUT = 10 # Seconds a caller waits for a lookup before giving up on it
+price_executor = ThreadPoolExecutor(max_workers=PRICE_WORKERS, thread_name_prefix='price')
+price_lookups = {} # (function, args) -> Future still running, callers asking for the same lookup share it
+price_lookups_lock = threading.Lock()
+
+def submit_lookup(function, *args): # At most one lookup per function and pool in the pool, a dead RPC can only tie up one worker per pool
+    key = (function, args)
+    with price_lookups_lock:
+        future = price_lookups.get(key)
+        if future is not None:
+            return future
+
+        future = price_lookups[key] = price_executor.submit(function, *args)
+    future.add_done_callback(lambda done: forget_lookup(key, done))
+    return future
+
+def forget_lookup(key, future):
+    with price_lookups_lock:
+        if price_lookups.get(key) is future:
+            del price_lookups[key]
+
+def fetch_prices(pairs, timeout=PRICE_TIMEOUT) -> dict: # (chain, lp_address) -> USD price, or None if it failed or timed out
+    futures = {pair: submit_lookup(get_token_price_in_usd, *pair) for pair in set(pairs)}
+    wait(futures.values(), timeout=timeout)
+
+    prices = {}
+    for (chain, lp_address), future in futures.items():
+        if future.done():
+            prices[(chain, lp_address)] = future.result() # get_token_price_in_usd handles its own errors
+        else: # Left to finish in the pool, later callers for this pool wait on it instead of submitting another
+            print(f"Timed out fetching the price of {lp_address} on {chain} after {timeout}s.")
+            prices[(chain, lp_address)] = None
+    return prices
+
+def fetch_price(chain, lp_address, timeout=PRICE_TIMEOUT):
+    return fetch_prices([(chain, lp_address)], timeout)[(chain, lp_address)]
+
+def call_with_timeout(function, *args, timeout=PRICE_TIMEOUT): # Runs any slow lookup on the price pool so a dead provider cannot hold a dispatcher worker
+    future = submit_lookup(function, *args)
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        print(f"{function.__name__} failed or timed out after {timeout}s: {e!r}")
+        return None
+#endregion Price Service
 ##
 #
 ##
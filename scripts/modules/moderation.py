@@ -0,0 +1,167 @@
+import re
+
+## Import the needed modules from the config folder
+# {config.py} - Address, URL and domain patterns
+# {cache.py} - Bounded group document cache, compiled matchers are stored on its entries
+from modules import config, cache
+
+#region Message Scanner
+MENTION_PATTERN = r'@(?=(?P<mention>\w+))' # Only the @ is consumed so a domain right after it (e.g. in an email) is still found
+SCAN_PATTERN = re.compile( # URLs first, they can contain every other kind of match
+    rf'(?P<url>{config.URL_PATTERN.pattern})'
+    rf'|(?P<domain>{config.DOMAIN_PATTERN.pattern})'
+    rf'|(?P<address>{config.ETH_ADDRESS_PATTERN.pattern})'
+    rf'|{MENTION_PATTERN}'
+)
+URL_INNER_PATTERN = re.compile( # What the standalone patterns would also have found inside a URL
+    rf'(?P<domain>{config.DOMAIN_PATTERN.pattern})'
+    rf'|(?P<address>{config.ETH_ADDRESS_PATTERN.pattern})'
+    rf'|{MENTION_PATTERN}'
+)
+class ScanResult: # Everything moderation looks for in a message, found in a single pass
+    def __init__(self):
+        self.addresses = []
+        self.urls = []
+        self.domains = []
+        self.mentions = []
+
+    def __repr__(self):
+        return f"ScanResult(addresses={self.addresses}, urls={self.urls}, domains={self.domains}, mentions={self.mentions})"
+
+def scan_message(text: str) -> ScanResult: # Same matches as running findall with each pattern separately
+    result = ScanResult()
+    if text and not scan_span(text, 0, len(text), SCAN_PATTERN, result):
+        result = scan_separately(text) # Rare, see url_cut_short()
+    return result
+
+def scan_separately(text: str) -> ScanResult: # Reference behaviour, one findall per pattern
+    result = ScanResult()
+    result.urls = config.URL_PATTERN.findall(text)
+    result.domains = config.DOMAIN_PATTERN.findall(text)
+    result.addresses = config.ETH_ADDRESS_PATTERN.findall(text)
+    result.mentions = [match.group('mention') for match in re.finditer(MENTION_PATTERN, text)]
+    return result
+
+def url_cut_short(text: str, end: int) -> bool: # URL_PATTERN stops at non-ASCII letters that \w still matches, so a domain or mention inside the URL could run on past it
+    return end < len(text) and not text[end].isascii() and re.match(r'\w', text[end]) is not None
+
+def scan_span(text: str, start: int, end: int, pattern: re.Pattern, result: ScanResult) -> bool: # False when the scan can't match the separate patterns exactly
+    position = start
+    while True:
+        match = pattern.search(text, position, end)
+        if match is None:
+            return True
+
+        kind = match.lastgroup
+        position = match.end()
+        if kind == 'url':
+            if url_cut_short(text, match.end()):
+                return False
+            result.urls.append(match.group())
+            scan_span(text, match.start(), match.end(), URL_INNER_PATTERN, result)
+        elif kind == 'domain':
+            result.domains.append(match.group())
+            result.addresses.extend(config.ETH_ADDRESS_PATTERN.findall(match.group())) # Only an address can hide inside a domain
+
+            scheme_start = text.rfind('http', match.start(), match.end()) # A domain glued to a URL ("site.comhttps://...") swallows its scheme
+            url = config.URL_PATTERN.match(text, scheme_start) if scheme_start != -1 and pattern is SCAN_PATTERN else None
+            if url is not None:
+                if url_cut_short(text, url.end()):
+                    return False
+                result.urls.append(url.group())
+                scan_span(text, match.end(), url.end(), URL_INNER_PATTERN, result)
+                position = url.end()
+        elif kind == 'address':
+            result.addresses.append(match.group())
+        elif kind == 'mention':
+            result.mentions.append(match.group('mention'))
+#endregion Message Scanner
+##
+#
+##
+#region Blocklist
+def compile_phrases(phrases: list) -> re.Pattern | None: # One regex for the whole blocklist, factored into a trie so shared prefixes are only matched once
+    trie = {}
+    for phrase in phrases:
+        if not isinstance(phrase, str):
+            continue
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True # End of a phrase
+
+    if not trie:
+        return None
+    return re.compile(rf'\b{trie_to_regex(trie)}\b')
+
+def trie_to_regex(node: dict) -> str: # Optional branches are greedy, so longer phrases are tried first and backtracking falls back to shorter ones
+    alternatives = [re.escape(char) + trie_to_regex(child) for char, child in sorted(node.items()) if char != '']
+    if not alternatives:
+        return ''
+
+    optional = '' in node
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+    return f"(?:{'|'.join(alternatives)}){'?' if optional else ''}"
+
+def find_blocked_phrase(group_id: str, group_data: dict, message_text: str) -> str | None: # Returns the first blocked phrase found in the (lowercased) message
+    blocklist = group_data.get('blocklist', [])
+    if not isinstance(blocklist, list):
+        print("Blocklist is not properly formatted as an array.")
+        return None
+
+    pattern = cache.group_cache.derive(group_id, 'blocklist_matcher', blocklist, compile_phrases)
+    if pattern is None:
+        return None
+
+    match = pattern.search(message_text)
+    return match.group() if match else None
+#endregion Blocklist
+##
+#
+##
+#region Allowlist
+class Allowlist: # Character trie over normalized allowlist entries, answers "does this item start with any allowed entry" in O(len(item))
+    def __init__(self, items: list):
+        self.items = set() # Raw entries for exact lookups
+        self.root = {}
+        for item in items:
+            if not isinstance(item, str):
+                continue
+            self.items.add(item)
+
+            node = self.root
+            for char in normalize_allowlist_item(item):
+                node = node.setdefault(char, {})
+            node[''] = True
+
+    def __contains__(self, item: str) -> bool:
+        return item in self.items
+
+    def allows(self, item: str) -> bool: # Same result as any(item.startswith(allowed) for allowed in allowlist)
+        node = self.root
+        if '' in node:
+            return True
+
+        for char in item:
+            node = node.get(char)
+            if node is None:
+                return False
+            if '' in node:
+                return True
+        return False
+
+def normalize_allowlist_item(item: str) -> str:
+    return item.strip().lower().rstrip('/')
+
+def normalize_found_item(item: str) -> str: # Found links and domains are compared without their scheme
+    return item.lower().replace('http://', '').replace('https://', '').rstrip('/')
+
+def get_allowlist(group_id: str, group_data: dict) -> Allowlist | None:
+    allowlist = group_data.get('allowlist', [])
+    if not isinstance(allowlist, list):
+        print("Allowlist is not in the correct format.")
+        return None
+
+    return cache.group_cache.derive(group_id, 'allowlist_matcher', allowlist, Allowlist)
+#endregion Allowlist
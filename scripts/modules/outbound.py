@@ -0,0 +1,169 @@
+import time
+import heapq
+import threading
+from collections import deque
+from telegram.error import RetryAfter, TimedOut, NetworkError
+#
+## Outbound message queue shared by every handler and background job.
+## Handlers call send() and return right away, worker threads deliver the messages while keeping under
+## Telegram's global limit (~30 messages per second) and the per-chat limits (~20 per minute in groups).
+## A RetryAfter only delays the chat that hit it, the rest of the queue keeps moving.
+#
+
+#region Outbound Queue
+OUTBOUND_WORKERS = 4
+OUTBOUND_GLOBAL_RATE = 30 # Messages per second across all chats
+OUTBOUND_GROUP_INTERVAL = 3.0 # Seconds between messages in the same group
+OUTBOUND_PRIVATE_INTERVAL = 1.0 # Seconds between messages in the same private chat
+OUTBOUND_MAX_CHAT_QUEUE = 50 # Oldest messages for a chat are dropped past this
+OUTBOUND_MAX_ATTEMPTS = 5 # Network errors are retried this many times with exponential backoff
+OUTBOUND_BACKOFF = 1.0 # Seconds, doubled on every failed attempt
+
+class OutboundJob:
+    __slots__ = ('method', 'kwargs', 'on_sent', 'attempts')
+
+    def __init__(self, method, kwargs, on_sent):
+        self.method = method
+        self.kwargs = kwargs
+        self.on_sent = on_sent
+        self.attempts = 0
+
+class OutboundQueue:
+    def __init__(self, workers=OUTBOUND_WORKERS, global_rate=OUTBOUND_GLOBAL_RATE):
+        self.worker_count = workers
+        self.global_interval = 1.0 / global_rate
+        self.bot = None
+        self.chats = {} # chat_id -> deque of OutboundJob, present while the chat has queued or in-flight messages
+        self.ready = [] # Heap of (ready_at, sequence, chat_id) for chats waiting on a worker
+        self.cooldowns = {} # chat_id -> earliest time the next message may go out, for chats with nothing queued
+        self.sequence = 0
+        self.next_send = 0.0 # Earliest time the next message may go out in any chat
+        self.condition = threading.Condition()
+        self.workers = []
+        self.running = False
+
+    def start(self, bot):
+        with self.condition:
+            if self.running:
+                return
+            self.bot = bot
+            self.running = True
+
+        for index in range(self.worker_count):
+            worker = threading.Thread(target=self._run, name=f"outbound-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        print(f"Outbound queue started with {self.worker_count} workers.")
+
+    def stop(self, timeout=10.0): # Lets the workers drain what is already queued, up to the timeout
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.time()))
+        self.workers = []
+
+    def send(self, chat_id, method='send_message', on_sent=None, **kwargs): # Fire-and-forget, on_sent(message) runs on a worker thread once delivered
+        kwargs['chat_id'] = chat_id
+        job = OutboundJob(method, kwargs, on_sent)
+        chat_id = str(chat_id) # Group ids arrive both as int and str
+
+        with self.condition:
+            queue = self.chats.get(chat_id)
+            if queue is None:
+                queue = self.chats[chat_id] = deque()
+                self._schedule(chat_id, self.cooldowns.pop(chat_id, 0.0))
+            elif len(queue) >= OUTBOUND_MAX_CHAT_QUEUE:
+                queue.popleft()
+                print(f"Outbound queue for chat {chat_id} is full, dropped its oldest message.")
+            queue.append(job)
+            self.condition.notify()
+
+    def pending(self) -> int:
+        with self.condition:
+            return sum(len(queue) for queue in self.chats.values())
+
+    def _schedule(self, chat_id, ready_at): # Caller must hold the condition
+        self.sequence += 1
+        heapq.heappush(self.ready, (ready_at, self.sequence, chat_id))
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                if not self.ready:
+                    if not self.running:
+                        return None, None
+                    self.condition.wait()
+                    continue
+
+                current_time = time.time()
+                wait = max(self.ready[0][0], self.next_send) - current_time
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+
+                _, _, chat_id = heapq.heappop(self.ready)
+                self.next_send = max(current_time, self.next_send) + self.global_interval
+                return chat_id, self.chats[chat_id].popleft() # The chat stays off the heap until this job is done
+
+    def _run(self):
+        while True:
+            chat_id, job = self._next_job()
+            if job is None:
+                return
+
+            ready_at, retry = self._deliver(chat_id, job)
+
+            with self.condition:
+                queue = self.chats[chat_id]
+                if retry:
+                    queue.appendleft(job) # Retry before anything newer for the same chat
+                if queue:
+                    self._schedule(chat_id, ready_at)
+                    self.condition.notify()
+                else:
+                    del self.chats[chat_id]
+                    self.cooldowns[chat_id] = ready_at
+                    if len(self.cooldowns) > 1000:
+                        self._sweep_cooldowns(time.time())
+
+    def _deliver(self, chat_id, job) -> tuple: # Returns (when the chat may send again, whether to retry the job)
+        interval = chat_interval(chat_id)
+        try:
+            message = getattr(self.bot, job.method)(**job.kwargs)
+        except RetryAfter as e: # Flood waits are always honored, they do not count as failed attempts
+            print(f"Flood wait of {e.retry_after}s for chat {chat_id}, retrying {job.method} after it.")
+            return time.time() + e.retry_after, True
+        except (TimedOut, NetworkError) as e:
+            job.attempts += 1
+            if job.attempts >= OUTBOUND_MAX_ATTEMPTS:
+                print(f"Giving up on {job.method} to chat {chat_id} after {job.attempts} attempts: {e}")
+                return time.time() + interval, False
+            print(f"Error sending {job.method} to chat {chat_id}, attempt {job.attempts}: {e}")
+            return time.time() + OUTBOUND_BACKOFF * 2 ** (job.attempts - 1), True
+        except Exception as e:
+            print(f"Failed to send {job.method} to chat {chat_id}: {e}")
+            return time.time() + interval, False
+
+        if job.on_sent is not None:
+            try:
+                job.on_sent(message)
+            except Exception as e:
+                print(f"Error in outbound callback for chat {chat_id}: {e}")
+        return time.time() + interval, False
+
+    def _sweep_cooldowns(self, current_time): # Caller must hold the condition
+        expired = [chat_id for chat_id, ready_at in self.cooldowns.items() if ready_at <= current_time]
+        for chat_id in expired:
+            del self.cooldowns[chat_id]
+
+def chat_interval(chat_id) -> float: # Private chats have positive ids, groups and channels negative ones
+    try:
+        return OUTBOUND_PRIVATE_INTERVAL if int(chat_id) > 0 else OUTBOUND_GROUP_INTERVAL
+    except (TypeError, ValueError): # @channelusername
+        return OUTBOUND_GROUP_INTERVAL
+
+outbound = OutboundQueue()
+#endregion Outbound Queue
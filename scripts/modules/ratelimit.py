@@ -0,0 +1,84 @@
+import time
+import threading
+from cachetools import LRUCache
+
+## Import the needed modules from the config folder
+# {config.py} - Bot-wide and per-group rate limit settings
+from modules import config
+#
+## Token buckets for bot commands. Each bucket holds up to {MESSAGE_COUNT} tokens and refills at
+## {MESSAGE_COUNT} per {TIME_PERIOD}, so the sustained rate matches the old fixed windows but a burst
+## can never exceed one bucket's worth (fixed windows let twice that through across a window edge).
+#
+
+#region Rate Limiting
+COMMAND_COSTS = { # Commands that render media or call external APIs drain the buckets faster
+    'chart': 5,
+    'liquidity': 2,
+    'volume': 2,
+    'play': 2,
+    'rick': 2,
+}
+DEFAULT_COMMAND_COST = 1
+MAX_GROUP_BUCKETS = 10000 # Least recently used groups are forgotten past this, a forgotten group starts with a full bucket
+
+class TokenBucket:
+    __slots__ = ('capacity', 'refill_rate', 'tokens', 'updated_at')
+
+    def __init__(self, capacity, period, current_time):
+        self.capacity = capacity
+        self.refill_rate = capacity / period # Tokens per second
+        self.tokens = float(capacity)
+        self.updated_at = current_time
+
+    def refill(self, current_time):
+        elapsed = current_time - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.updated_at = current_time
+
+    def has(self, cost) -> bool:
+        return self.tokens >= min(cost, self.capacity) # A cost above capacity would never fit, treat it as a full bucket
+
+    def take(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+class RateLimiter:
+    def __init__(self, bot_count, bot_period, group_count, group_period, max_groups=MAX_GROUP_BUCKETS):
+        self.group_count = group_count
+        self.group_period = group_period
+        self.bot_bucket = TokenBucket(bot_count, bot_period, time.monotonic())
+        self.group_buckets = LRUCache(maxsize=max_groups)
+        self.lock = threading.Lock()
+
+    def allow(self, chat_id, command=None) -> bool: # Takes the command's cost from both buckets, or from neither if either is short
+        cost = COMMAND_COSTS.get(command, DEFAULT_COMMAND_COST)
+        chat_id = str(chat_id)
+        current_time = time.monotonic()
+
+        with self.lock:
+            self.bot_bucket.refill(current_time)
+            if not self.bot_bucket.has(cost):
+                print("Bot-wide rate limit exceeded.")
+                return False
+
+            group_bucket = self.group_buckets.get(chat_id)
+            if group_bucket is None:
+                group_bucket = self.group_buckets[chat_id] = TokenBucket(self.group_count, self.group_period, current_time)
+            else:
+                group_bucket.refill(current_time)
+            if not group_bucket.has(cost):
+                print(f"Group {chat_id} rate limit exceeded.")
+                return False
+
+            self.bot_bucket.take(cost)
+            group_bucket.take(cost)
+            return True
+
+limiter = RateLimiter(
+    bot_count=config.BOT_RATE_LIMIT_MESSAGE_COUNT,
+    bot_period=config.BOT_RATE_LIMIT_TIME_PERIOD,
+    group_count=config.GROUP_RATE_LIMIT_MESSAGE_COUNT,
+    group_period=config.GROUP_RATE_LIMIT_TIME_PERIOD
+)
+#endregion Rate Limiting
@@ -0,0 +1,405 @@
+import copy
+import time
+import threading
+from cachetools import TTLCache
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+## Import the needed modules from the config folder
+# {config.py} - Environment variables and global variables used in the bot
+# {firebase.py} - Firebase configuration and database initialization
+# {cache.py} - Bounded group document cache kept fresh by Firestore listeners
+from modules import config, firebase, cache
+
+#region Group Repository
+class GroupRepository: # Single write entry point for group documents, applies every write to Firestore and the cached copy together
+    def __init__(self, group_cache):
+        self.group_cache = group_cache
+        self.write_buffer = WriteBuffer(self, window=WRITE_BUFFER_WINDOW, max_updates=WRITE_BUFFER_MAX_UPDATES)
+        self.group_cache.overlay = self.write_buffer.overlay # Snapshots don't include buffered writes yet, reapply them
+        self.member_storage = config.MEMBER_STORAGE
+        self.member_cache = TTLCache(maxsize=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL) # Only used for subcollection storage
+        self.member_lock = threading.Lock()
+
+    def document(self, group_id: str):
+        return firebase.DATABASE.collection('groups').document(str(group_id))
+
+    def update(self, group_id: str, updates: dict) -> None: # Field-path update, e.g. {'admin.mute': True}
+        group_id = str(group_id)
+        self.write_buffer.flush(group_id) # Buffered writes for this group must land first so they can't overwrite this one
+        group_doc = self.document(group_id)
+        group_doc.update(updates)
+        self._apply_to_cache(group_id, updates)
+
+    def buffer_update(self, group_id: str, updates: dict) -> None: # Same as update(), but coalesced with other writes and committed in one batch shortly after
+        group_id = str(group_id)
+        self.write_buffer.add(group_id, updates)
+        self._apply_to_cache(group_id, updates)
+
+    def flush(self) -> None: # Commit every buffered write now, used on shutdown
+        self.write_buffer.flush()
+
+    def set(self, group_id: str, group_data: dict) -> None: # Replaces the whole document
+        group_id = str(group_id)
+        self.write_buffer.flush(group_id)
+        group_doc = self.document(group_id)
+        group_doc.set(group_data)
+        self.group_cache.set(group_id, copy.deepcopy(group_data), group_doc)
+        print(f"Wrote and cached full document for group {group_id}.")
+
+    def delete(self, group_id: str) -> None:
+        group_id = str(group_id)
+        self.write_buffer.flush(group_id)
+        if self.member_storage == 'subcollection': # Firestore doesn't cascade deletes into subcollections
+            self._delete_member_documents(group_id)
+        self.document(group_id).delete()
+        self.group_cache.delete(group_id)
+        print(f"Deleted document and cache for group {group_id}.")
+
+    def _apply_to_cache(self, group_id: str, updates: dict) -> None:
+        with self.group_cache.lock:
+            entry = self.group_cache.get(group_id)
+            if entry is None:
+                return # Nothing cached, the next read will fetch the written document
+
+            group_data = copy.deepcopy(entry["group_data"]) # Copy on write so readers never see a half-applied update
+            if apply_field_updates(group_data, updates):
+                self.group_cache.set(group_id, group_data, entry["group_doc"])
+                print(f"Applied write-through update to cached group {group_id}: {list(updates)}")
+            else: # An update we can't mirror locally, fall back to a re-read
+                self.group_cache.delete(group_id)
+                print(f"Dropped cache for group {group_id}, update could not be mirrored locally.")
+
+    #region Group Members
+    # unverified_users, untrusted_users, muted_users and warnings are keyed by user ID. In 'field' storage they are
+    # maps on the group document, written with atomic field paths. In 'subcollection' storage every entry is its
+    # own document at groups/{group_id}/{field}/{user_id} holding {'value': ...}, so the group document stays small.
+    def member_document(self, group_id: str, field: str, user_id: str):
+        return self.document(group_id).collection(field).document(str(user_id))
+
+    def get_member(self, group_id: str, field: str, user_id: str, fresh: bool = False, default=None): # Returns the stored value, or default if the user isn't in the mapping
+        group_id, user_id = str(group_id), str(user_id)
+        if fresh:
+            self.write_buffer.flush(group_id) # A fresh read has to see writes still sitting in the buffer
+
+        if self.member_storage == 'subcollection':
+            key = (group_id, field, user_id)
+            value = MISSING
+            if not fresh:
+                with self.member_lock:
+                    value = self.member_cache.get(key, MISSING)
+
+            if value is MISSING:
+                snapshot = self.member_document(group_id, field, user_id).get()
+                value = snapshot.to_dict().get('value') if snapshot.exists else ABSENT
+                with self.member_lock:
+                    self.member_cache[key] = value
+            return default if value is ABSENT else value
+
+        if not fresh:
+            entry = self.group_cache.get(group_id)
+            if entry is not None:
+                return (entry["group_data"].get(field) or {}).get(user_id, default)
+
+        field_path = firestore.FieldPath(field, user_id).to_api_repr()
+        snapshot = self.document(group_id).get(field_paths=[field_path]) # Read only this entry, not the whole document
+        if not snapshot.exists:
+            return default
+        return ((snapshot.to_dict() or {}).get(field) or {}).get(user_id, default)
+
+    def is_member(self, group_id: str, field: str, user_id: str, fresh: bool = False) -> bool:
+        return self.get_member(group_id, field, user_id, fresh=fresh, default=MISSING) is not MISSING
+
+    def list_members(self, group_id: str, field: str, group_data: dict = None) -> dict: # user_id -> value for the whole mapping
+        group_id = str(group_id)
+
+        if self.member_storage == 'subcollection':
+            return {
+                member.id: member.to_dict().get('value')
+                for member in self.document(group_id).collection(field).stream()
+            }
+
+        if group_data is None:
+            entry = self.group_cache.get(group_id)
+            if entry is not None:
+                group_data = entry["group_data"]
+            else:
+                snapshot = self.document(group_id).get(field_paths=[field])
+                group_data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        return dict(group_data.get(field) or {})
+
+    def set_member(self, group_id: str, field: str, user_id: str, value, buffered: bool = False) -> None:
+        group_id, user_id = str(group_id), str(user_id)
+
+        if self.member_storage == 'subcollection':
+            member_doc = self.member_document(group_id, field, user_id)
+            if buffered:
+                self.write_buffer.add(group_id, {'value': value}, document=member_doc, replace=True)
+            else:
+                self.write_buffer.flush(group_id)
+                member_doc.set({'value': value})
+            with self.member_lock:
+                self.member_cache[(group_id, field, user_id)] = copy.deepcopy(value)
+            return
+
+        updates = {f'{field}.{user_id}': value}
+        if buffered:
+            self.buffer_update(group_id, updates)
+        else:
+            self.update(group_id, updates)
+
+    def update_member(self, group_id: str, field: str, user_id: str, updates: dict) -> None: # Updates keys inside a map-valued entry, e.g. the challenge of an unverified user
+        group_id, user_id = str(group_id), str(user_id)
+
+        if self.member_storage == 'subcollection':
+            self.write_buffer.flush(group_id)
+            self.member_document(group_id, field, user_id).update({f'value.{key}': value for key, value in updates.items()})
+            with self.member_lock:
+                self.member_cache.pop((group_id, field, user_id), None)
+            return
+
+        self.update(group_id, {f'{field}.{user_id}.{key}': value for key, value in updates.items()})
+
+    def delete_member(self, group_id: str, field: str, user_id: str) -> None:
+        group_id, user_id = str(group_id), str(user_id)
+
+        if self.member_storage == 'subcollection':
+            self.write_buffer.flush(group_id)
+            self.member_document(group_id, field, user_id).delete()
+            with self.member_lock:
+                self.member_cache[(group_id, field, user_id)] = ABSENT
+            return
+
+        self.update(group_id, {f'{field}.{user_id}': firestore.DELETE_FIELD})
+
+    def forget_members(self, group_id: str) -> None: # Drop cached member entries for a group
+        group_id = str(group_id)
+        with self.member_lock:
+            for key in [key for key in self.member_cache.keys() if key[0] == group_id]:
+                self.member_cache.pop(key, None)
+
+    def _delete_member_documents(self, group_id: str) -> None:
+        for field in MEMBER_FIELDS:
+            member_docs = list(self.document(group_id).collection(field).list_documents())
+            for start in range(0, len(member_docs), BATCH_WRITE_LIMIT):
+                batch = firebase.DATABASE.batch()
+                for member_doc in member_docs[start:start + BATCH_WRITE_LIMIT]:
+                    batch.delete(member_doc)
+                batch.commit()
+        self.forget_members(group_id)
+        print(f"Deleted member subcollections for group {group_id}.")
+    #endregion Group Members
+
+def apply_field_updates(group_data: dict, updates: dict) -> bool: # Mirrors Firestore field-path update semantics on a plain dict
+    for field_path, value in updates.items():
+        keys = field_path.split('.')
+        parent = group_data
+
+        for key in keys[:-1]:
+            child = parent.get(key)
+            if not isinstance(child, dict): # Firestore creates (or replaces) intermediate maps
+                child = {}
+                parent[key] = child
+            parent = child
+
+        leaf = keys[-1]
+        if value is firestore.DELETE_FIELD:
+            parent.pop(leaf, None)
+        elif isinstance(value, firestore.ArrayUnion):
+            current = parent.get(leaf)
+            current = list(current) if isinstance(current, list) else []
+            current.extend(item for item in value.values if item not in current)
+            parent[leaf] = current
+        elif isinstance(value, firestore.ArrayRemove):
+            current = parent.get(leaf)
+            current = list(current) if isinstance(current, list) else []
+            parent[leaf] = [item for item in current if item not in value.values]
+        elif isinstance(value, firestore.Increment) or value is firestore.SERVER_TIMESTAMP:
+            return False # Server-side transforms can race the snapshot listener, let Firestore be the source of truth
+        else:
+            parent[leaf] = copy.deepcopy(value)
+    return True
+
+MEMBER_FIELDS = ('unverified_users', 'untrusted_users', 'muted_users', 'warnings')
+MEMBER_CACHE_SIZE = 10000 # Member entries held in memory with subcollection storage
+MEMBER_CACHE_TTL = 60 # Seconds a cached member entry is trusted, bounds staleness from writes made by other processes
+MISSING = object() # Returned by get_member(default=MISSING) when the user isn't in the mapping
+ABSENT = object() # Cached "not a member" for subcollection storage, distinct from a cache miss
+#endregion Group Repository
+##
+#
+##
+#region Write Buffer
+WRITE_BUFFER_WINDOW = 1.0 # Seconds buffered updates wait for more writes before being committed
+WRITE_BUFFER_MAX_UPDATES = 200 # Pending field updates that trigger an early commit
+BATCH_WRITE_LIMIT = 500 # Firestore's maximum number of writes in a single batch
+WRITE_BUFFER_MAX_ATTEMPTS = 5 # Commits a document's buffered writes are retried before they are given up on
+WRITE_BUFFER_RETRY_DELAY = 1.0 # Seconds before a failed document is retried, doubled on every attempt
+class WriteBuffer: # Coalesces field updates per document and commits them in one WriteBatch per group from a background thread
+    def __init__(self, repository, window, max_updates):
+        self.repository = repository
+        self.window = window
+        self.max_updates = max_updates
+        self.pending = {} # document path -> {"group_id", "document", "updates", "replace", "attempts", "retry_at"}, later writes to the same field win
+        self.pending_count = 0
+        self.committing = {} # Same shape as pending, the writes of the batch being committed right now
+        self.deadline = None # When the fresh writes are committed, documents retried after a failure wait for their own retry_at
+        self.condition = threading.Condition()
+        self.commit_lock = threading.Lock() # Serializes commits so a direct write never overtakes an in-flight batch
+        self.thread = None
+
+    def add(self, group_id: str, updates: dict, document=None, replace: bool = False) -> None: # Defaults to a field update on the group document, replace=True sets the whole document
+        document = document or self.repository.document(group_id)
+        with self.condition:
+            entry = self.pending.get(document.path)
+            if entry is None:
+                entry = {"group_id": group_id, "document": document, "updates": {}, "replace": replace, "attempts": 0, "retry_at": 0}
+                self.pending[document.path] = entry
+            pending_before = len(entry["updates"])
+
+            if replace:
+                entry["updates"] = dict(updates)
+                entry["replace"] = True
+            elif entry["replace"]: # Fold field updates into the pending document body
+                apply_field_updates(entry["updates"], updates)
+            else:
+                entry["updates"].update(updates)
+            self.pending_count += len(entry["updates"]) - pending_before
+
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.window
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+            self.condition.notify()
+        print(f"Buffered {len(updates)} update(s) for group {group_id}. {self.pending_count} pending.")
+
+    def flush(self, group_id: str = None, due_only: bool = False) -> None: # Commit pending writes now, for one group or all of them, due_only leaves documents that are backing off
+        with self.commit_lock:
+            with self.condition:
+                current_time = time.monotonic()
+                pending = {
+                    path: entry for path, entry in self.pending.items()
+                    if (group_id is None or entry["group_id"] == group_id) and (not due_only or entry["retry_at"] <= current_time)
+                }
+                for path, entry in pending.items():
+                    del self.pending[path]
+                    self.pending_count -= len(entry["updates"])
+                if not any(entry["retry_at"] == 0 for entry in self.pending.values()): # No fresh writes left waiting on the window
+                    self.deadline = None
+                if not pending:
+                    return
+                self.committing = pending
+
+            try:
+                self._commit(pending)
+            finally:
+                with self.condition:
+                    self.committing = {}
+
+    def overlay(self, group_id: str, group_data: dict) -> dict: # Reapplies writes to the group document that Firestore doesn't have yet
+        path = self.repository.document(group_id).path
+        with self.condition:
+            for entry in (self.committing.get(path), self.pending.get(path)): # Oldest first, the retried copy of a committing write is also pending
+                if entry is None:
+                    continue
+                if entry["replace"]:
+                    group_data = copy.deepcopy(entry["updates"])
+                else:
+                    apply_field_updates(group_data, entry["updates"])
+        return group_data
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    commit_at = self._next_commit()
+                    if commit_at is not None and (commit_at <= time.monotonic() or (self.deadline is not None and self.pending_count >= self.max_updates)):
+                        break # Due, or the buffer filled up with fresh writes before the window ended
+                    self.condition.wait(None if commit_at is None else commit_at - time.monotonic())
+
+            self.flush(due_only=True)
+
+    def _next_commit(self) -> float | None: # Caller must hold the condition
+        commit_times = [entry["retry_at"] for entry in self.pending.values() if entry["retry_at"]]
+        if self.deadline is not None:
+            commit_times.append(self.deadline)
+        return min(commit_times) if commit_times else None
+
+    def _commit(self, pending: dict) -> None: # Caller must hold the commit lock
+        group_entries = {}
+        for entry in pending.values():
+            group_entries.setdefault(entry["group_id"], []).append(entry)
+
+        for group_id, entries in group_entries.items(): # One batch per group, a bad document only holds up its own group's writes
+            for start in range(0, len(entries), BATCH_WRITE_LIMIT):
+                chunk = entries[start:start + BATCH_WRITE_LIMIT]
+                try:
+                    self._commit_batch(chunk)
+                    print(f"Committed {len(chunk)} buffered document write(s) for group {group_id}: {sum(len(entry['updates']) for entry in chunk)} field update(s).")
+                except Exception as e:
+                    print(f"Failed to commit buffered writes for group {group_id}: {e}")
+                    if len(chunk) == 1:
+                        self._retry(chunk[0], e)
+                        continue
+                    for entry in chunk: # Split the batch so only the failing documents are retried
+                        try:
+                            self._commit_batch([entry])
+                        except Exception as e:
+                            self._retry(entry, e)
+
+    def _commit_batch(self, entries: list) -> None:
+        batch = firebase.DATABASE.batch()
+        for entry in entries:
+            if entry["replace"]:
+                batch.set(entry["document"], entry["updates"])
+            else:
+                batch.update(entry["document"], entry["updates"])
+        batch.commit()
+
+    def _retry(self, entry: dict, error: Exception) -> None: # Puts a failed document back in the buffer, behind any newer writes to it
+        group_id = entry["group_id"]
+        if isinstance(error, NotFound): # Deleted while its writes were queued, there is nothing left to update
+            print(f"Dropped buffered writes to {entry['document'].path}, the document no longer exists.")
+            self._invalidate(group_id)
+            return
+
+        entry["attempts"] += 1
+        if entry["attempts"] >= WRITE_BUFFER_MAX_ATTEMPTS:
+            print(f"Giving up on buffered writes to {entry['document'].path} after {entry['attempts']} attempts: {error}")
+            self._invalidate(group_id)
+            return
+
+        with self.condition:
+            path = entry["document"].path
+            newer = self.pending.get(path)
+            if newer is None:
+                self.pending[path] = entry
+                self.pending_count += len(entry["updates"])
+            else:
+                pending_before = len(newer["updates"])
+                if newer["replace"]: # A newer full set overrides everything that failed
+                    pass
+                elif entry["replace"]: # Fold the newer field updates into the failed document body
+                    apply_field_updates(entry["updates"], newer["updates"])
+                    newer["updates"] = entry["updates"]
+                    newer["replace"] = True
+                else:
+                    newer["updates"] = {**entry["updates"], **newer["updates"]}
+                newer["attempts"] = max(newer["attempts"], entry["attempts"])
+                self.pending_count += len(newer["updates"]) - pending_before
+
+            retry_at = time.monotonic() + WRITE_BUFFER_RETRY_DELAY * 2 ** (entry["attempts"] - 1) # Only this document waits, other groups keep the normal window
+            retried = self.pending[path]
+            retried["retry_at"] = max(retried["retry_at"], retry_at)
+            self.condition.notify()
+        print(f"Requeued buffered writes to {path}, attempt {entry['attempts']}.")
+
+    def _invalidate(self, group_id: str) -> None: # The caches already hold the lost updates, drop them so reads go back to Firestore
+        self.repository.group_cache.delete(group_id)
+        self.repository.forget_members(group_id)
+#endregion Write Buffer
+
+groups = GroupRepository(cache.group_cache)
@@ -1,6 +1,4 @@
 import re
-import os
-import json
 from web3 import Web3
 from io import BytesIO
 
@@ -9,12 +7,12 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 
 # Import custom modules from the scripts directory
-# {main.py} is the core script that contains the main logic to run the bot
 # {config.py} contains all the configuration settings for the bot
 # {utils.py} contains utility functions that are used throughout the bot
 # {firebase.py} contains all the Firebase functions to interact with the database
-from scripts import main
-from modules import config, utils, firebase
+# {repository.py} applies group document writes to Firestore and the cache together
+# {crypto.py} schedules buybot monitoring for premium groups
+from modules import config, utils, firebase, repository, crypto
 ##
 
 #region Bot Setup
@@ -93,6 +91,9 @@ def handle_setup_inputs_from_admin(update: Update, context: CallbackContext) ->
     elif context.chat_data.get('setup_stage') == 'medium_buy':
         print(f"Received medium buy amount in group {update.effective_chat.id}")
         handle_medium_buy(update, context)
+    elif context.chat_data.get('setup_stage') == 'digest_buy':
+        print(f"Received digest buy amount in group {update.effective_chat.id}")
+        handle_digest_buy(update, context)
 
 def setup_start(update: Update, context: CallbackContext) -> None:
     msg = None
@@ -169,7 +170,6 @@ def setup_home_callback(update: Update, context: CallbackContext) -> None:
 def setup_home(update: Update, context: CallbackContext) -> None:
     msg = None
     group_id = update.effective_chat.id
-    group_doc = utils.fetch_group_info(update, context, return_doc=True)
 
     try:
         group_link = context.bot.export_chat_invite_link(group_id)
@@ -230,11 +230,10 @@ def setup_home(update: Update, context: CallbackContext) -> None:
     if msg is not None:
         utils.track_message(msg)
 
-    group_doc.update({
+    repository.groups.update(update.effective_chat.id, {
         'group_info.group_link': group_link,
         'group_info.group_username': group_username,
     })
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
 SETUP_CALLBACK_DATA = [
     'setup_admin', 'reset_admin_settings',
@@ -308,13 +307,7 @@ def setup_admin(update: Update, context: CallbackContext) -> None:
 
 def reset_admin_settings(update: Update, context: CallbackContext) -> None:
     group_id = update.effective_chat.id  # Get the group ID
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
-        print("Failed to fetch group info. No action taken.")
-        return
-
-    group_data, group_doc = result  # Unpack the tuple
-
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
     if not group_data: # Log if group data is missing
         print(f"No group data found for group ID {group_id}. Cannot reset admin settings.")
         update.message.reply_text("Group settings not found. Please ensure the group is properly registered.")
@@ -327,8 +320,7 @@ def reset_admin_settings(update: Update, context: CallbackContext) -> None:
         'allowlist': False,
         'blocklist': False
     }
-    group_doc.update({'admin': new_admin_settings})
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+    repository.groups.update(update.effective_chat.id, {'admin': new_admin_settings})
 
     msg = update.message.reply_text("Admin settings have been reset to default.")
     store_setup_message(context, msg.message_id)
@@ -372,25 +364,21 @@ def setup_mute(update: Update, context: CallbackContext) -> None:
 def enable_mute(update: Update, context: CallbackContext) -> None:
     msg = None
 
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'mute': True
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.mute': True
         })
-    
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -405,26 +393,22 @@ def enable_mute(update: Update, context: CallbackContext) -> None:
 def disable_mute(update: Update, context: CallbackContext) -> None:
     msg = None
 
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'mute': False
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.mute': False
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='❌ Muting has been disabled in this group ❌'
@@ -471,26 +455,22 @@ def setup_warn(update: Update, context: CallbackContext) -> None:
 def enable_warn(update: Update, context: CallbackContext) -> None:
     msg = None
 
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'warn': True
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.warn': True
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='✔️ Warning has been enabled in this group ✔️'
@@ -504,26 +484,22 @@ def enable_warn(update: Update, context: CallbackContext) -> None:
 def disable_warn(update: Update, context: CallbackContext) -> None:
     msg = None
 
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'warn': False
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.warn': False
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='❌ Warning has been disabled in this group ❌'
@@ -550,8 +526,6 @@ def set_max_warns(update: Update, context: CallbackContext) -> None:
         utils.track_message(msg)
 
 def handle_max_warns(update: Update, context: CallbackContext) -> None:
-    group_doc = utils.fetch_group_info(update, context, return_doc=True)
-
     if update.message.text:
         try:
             max_warns = int(update.message.text)
@@ -565,10 +539,9 @@ def handle_max_warns(update: Update, context: CallbackContext) -> None:
                 utils.track_message(msg)
             return
 
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.max_warns': max_warns
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -622,27 +595,23 @@ def enable_allowlist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'allowlist': True
             }
         })
     else:
         print(f"Updating allowlisting for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.allowlist': True
         })
-    
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -659,27 +628,23 @@ def disable_allowlist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'allowlist': False
             }
         })
     else:
         print(f"Updating allowlisting for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.allowlist': False
         })
-    
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -727,9 +692,7 @@ def handle_website_url(update: Update, context: CallbackContext) -> None:
             if config.URL_PATTERN.fullmatch(website_url):  # Use the global config.URL_PATTERN
                 group_id = update.effective_chat.id
                 print(f"Adding website URL {website_url} to group {group_id}")
-                group_doc = utils.fetch_group_info(update, context, return_doc=True)
-                group_doc.update({'group_info.website_url': website_url})
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+                repository.groups.update(update.effective_chat.id, {'group_info.website_url': website_url})
                 context.chat_data['setup_stage'] = None
 
                 if update.message is not None:
@@ -771,26 +734,22 @@ def clear_allowlist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'allowlist': []
         })
     else:
         print(f"Clearing allowlist for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'allowlist': []
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='❌ Allowlist has been cleared in this group ❌'
@@ -842,28 +801,24 @@ def enable_blocklist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'blocklist': True
             }
         })
     else:
         print(f"Updating blocklisting for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.blocklist': True
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='✔️ Blocklisting has been enabled in this group ✔️'
@@ -878,28 +833,24 @@ def disable_blocklist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'admin': {
                 'blocklist': False
             }
         })
     else:
         print(f"Updating blocklisting for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'admin.blocklist': False
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='❌ Blocklisting has been disabled in this group ❌'
@@ -949,26 +900,22 @@ def clear_blocklist(update: Update, context: CallbackContext) -> None:
     msg = None
 
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
         print(f"Creating new document for group {group_id}.")
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'blocklist': []
         })
     else:
         print(f"Clearing blocklist for group {group_id}.")
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'blocklist': []
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     msg = context.bot.send_message(
         chat_id=update.effective_chat.id,
         text='❌ Blocklist has been cleared in this group ❌'
@@ -1062,12 +1009,11 @@ def toggle_command_status(update: Update, context: CallbackContext) -> None:
         current_status = commands.get(command, True)  # Default to True if not set
 
         new_status = not current_status # Toggle the status
-        group_doc.update({f'commands.{command}': new_status})
+        repository.groups.update(chat_id, {f'commands.{command}': new_status})
         print(f"Toggled command '{command}' to {new_status} for group {chat_id}")
 
         status_text = "enabled" if new_status else "disabled"
         query.answer(text=f"Command '{command}' is now {status_text}.", show_alert=False)
-        utils.clear_group_cache(str(chat_id)) # Clear the cache on all database updates
 
         setup_commands(update, context)
     else:
@@ -1109,15 +1055,13 @@ def setup_authentication(update: Update, context: CallbackContext) -> None:
 def simple_authentication(update: Update, context: CallbackContext) -> None:
     msg = None
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'group_id': group_id,
             'verification_info': {
                 'verification_type': 'simple',
@@ -1125,14 +1069,12 @@ def simple_authentication(update: Update, context: CallbackContext) -> None:
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'verification_info': {
                 'verification_type': 'simple',
                 'verification_timeout': 600
             }
         })
-    
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
     menu_change(context, update)
 
@@ -1155,15 +1097,13 @@ def simple_authentication(update: Update, context: CallbackContext) -> None:
 def math_authentication(update: Update, context: CallbackContext) -> None:
     msg = None
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'group_id': group_id,
             'verification_info': {
                 'verification_type': 'math',
@@ -1171,15 +1111,13 @@ def math_authentication(update: Update, context: CallbackContext) -> None:
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'verification_info': {
                 'verification_type': 'math',
                 'verification_timeout': 600
             }
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     keyboard = [
         [InlineKeyboardButton("Back", callback_data='setup_authentication')]
     ]
@@ -1203,15 +1141,13 @@ def math_authentication(update: Update, context: CallbackContext) -> None:
 def word_authentication(update: Update, context: CallbackContext) -> None:
     msg = None
     group_id = update.effective_chat.id
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is None:
-        group_doc.set({
+        repository.groups.set(update.effective_chat.id, {
             'group_id': group_id,
             'verification_info': {
                 'verification_type': 'word',
@@ -1219,15 +1155,13 @@ def word_authentication(update: Update, context: CallbackContext) -> None:
             }
         })
     else:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'verification_info': {
                 'verification_type': 'word',
                 'verification_timeout': 600
             }
         })
 
-    utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
     context.chat_data['setup_stage'] = 'setup_word_verification'
 
     menu_change(context, update)
@@ -1299,9 +1233,7 @@ def handle_timeout_callback(update: Update, context: CallbackContext) -> None:
 
 def set_authentication_timeout(group_id: int, timeout_seconds: int) -> None: # Sets the verification timeout for a specific group in the Firestore database.
     try:
-        group_ref = firebase.DATABASE.collection('groups').document(str(group_id))
-
-        group_ref.update({
+        repository.groups.update(group_id, {
             'verification_info.verification_timeout': timeout_seconds
         })
 
@@ -1444,9 +1376,7 @@ def handle_contract_address(update: Update, context: CallbackContext) -> None:
                 checksum_address = Web3.to_checksum_address(contract_address)
                 group_id = update.effective_chat.id
                 print(f"Adding contract address {checksum_address} to group {group_id}")
-                group_doc = utils.fetch_group_info(update, context, return_doc=True)
-                group_doc.update({'token.contract_address': checksum_address})
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+                repository.groups.update(update.effective_chat.id, {'token.contract_address': checksum_address})
                 context.chat_data['setup_stage'] = None
 
                 if update.message is not None:
@@ -1501,9 +1431,7 @@ def handle_liquidity_address(update: Update, context: CallbackContext) -> None:
                 checksum_address = Web3.to_checksum_address(liquidity_address)
                 group_id = update.effective_chat.id
                 print(f"Adding liquidity address {checksum_address} to group {group_id}")
-                group_doc = utils.fetch_group_info(update, context, return_doc=True)
-                group_doc.update({'token.liquidity_address': checksum_address})
-                utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+                repository.groups.update(update.effective_chat.id, {'token.liquidity_address': checksum_address})
                 context.chat_data['setup_stage'] = None
 
                 # Check if update.message is not None before using it
@@ -1577,9 +1505,7 @@ def handle_chain(update: Update, context: CallbackContext) -> None:
             chain = update.callback_query.data.upper()  # Convert chain to uppercase
             group_id = update.effective_chat.id
             print(f"Adding chain {chain} to group {group_id}")
-            group_doc = utils.fetch_group_info(update, context, return_doc=True)
-            group_doc.update({'token.chain': chain})
-            utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
+            repository.groups.update(update.effective_chat.id, {'token.chain': chain})
             context.chat_data['setup_stage'] = None
 
             complete_token_setup(group_id, context)
@@ -1620,36 +1546,33 @@ def complete_token_setup(group_id: str, context: CallbackContext):
         print(f"Web3 provider not found for chain {chain}, token setup incomplete.")
         return
     
-    abi_path = os.path.join(config.CONFIG_DIR, 'erc20.abi.json')
-
-    with open(abi_path, 'r') as abi_file:
-        abi = json.load(abi_file)
-
-    contract = web3.eth.contract(address=contract_address, abi=abi)
-
-    try: # Call the name, symbol, and decimals functions
-        token_name = contract.functions.name().call()
-        token_symbol = contract.functions.symbol().call()
-        decimals = contract.functions.decimals().call()
-        total_supply = contract.functions.totalSupply().call() / (10 ** decimals)
-    except Exception as e:
-        print(f"Failed to get token name, symbol, total supply and decimals: {e}")
+    contract = config.get_contract(chain, contract_address, 'erc20')
+
+    token_name, token_symbol, decimals, total_supply = crypto.multicall(chain, [ # Call the name, symbol, decimals and totalSupply functions in one request
+        contract.functions.name(),
+        contract.functions.symbol(),
+        contract.functions.decimals(),
+        contract.functions.totalSupply()
+    ])
+    if None in (token_name, token_symbol, decimals, total_supply):
+        print("Failed to get token name, symbol, total supply and decimals.")
         return
+    total_supply = total_supply / (10 ** decimals)
     
-    group_doc.update({ # Update the Firestore document with the token name, symbol, and total supply
+    repository.groups.update(group_id, { # Update the Firestore document with the token name, symbol, and total supply
         'token.name': token_name,
         'token.symbol': token_symbol,
         'token.total_supply': total_supply,
         'token.decimals': decimals,
         'token.setup_complete': True
     })
-
-    utils.clear_group_cache(str(group_id)) # Clear the cache on all database updates
     
     print(f"Added token name {token_name}, symbol {token_symbol}, and total supply {total_supply} to group {group_id}")
 
+    group_data['group_id'] = str(group_id)
+    token_data.update({'name': token_name, 'symbol': token_symbol, 'total_supply': total_supply, 'decimals': decimals, 'setup_complete': True})
     if group_data.get('premium', False):  # Check if premium is True
-        main.schedule_group_monitoring(group_data) # Instantly start monitoring the group
+        crypto.schedule_group_monitoring(group_data) # Instantly start monitoring the group
     else:
         print(f"Group {group_data['group_id']} is not premium. Skipping monitoring.")
 
@@ -1719,20 +1642,16 @@ def check_token_details(update: Update, context: CallbackContext) -> None:
 
 def reset_token_details(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'token': {}
         })
 
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
-
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='*🔄 Token Details Reset 🔄*',
@@ -1826,13 +1745,11 @@ def setup_welcome_message_header(update: Update, context: CallbackContext) -> No
 def handle_welcome_message_image(update: Update, context: CallbackContext) -> None:
     if context.chat_data.get('expecting_welcome_message_header_image'):
         group_id = update.effective_chat.id
-        result = utils.fetch_group_info(update, context, return_both=True)  # Fetch both group_data and group_doc
-        if not result:
+        group_data = utils.fetch_group_info(update, context) # Fetch the group data
+        if not group_data:
             print("Failed to fetch group info. No action taken.")
             return
 
-        group_data, group_doc = result  # Unpack the tuple
-
         validation_result = validate_media(update)
 
         if not validation_result['valid']:
@@ -1874,11 +1791,10 @@ def handle_welcome_message_image(update: Update, context: CallbackContext) -> No
         print(f"Welcome message header URL: {welcome_message_url}")
 
         if group_data is not None:
-            group_doc.update({
+            repository.groups.update(update.effective_chat.id, {
                 'premium_features.welcome_header': True,
                 'premium_features.welcome_header_url': welcome_message_url
             })
-            utils.clear_group_cache(str(update.effective_chat.id))  # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -1914,13 +1830,11 @@ def setup_buybot_message_header(update: Update, context: CallbackContext) -> Non
 def handle_buybot_message_image(update: Update, context: CallbackContext) -> None:
     if context.chat_data.get('expecting_buybot_header_image'):
         group_id = update.effective_chat.id
-        result = utils.fetch_group_info(update, context, return_both=True)  # Fetch both group_data and group_doc
-        if not result:
+        group_data = utils.fetch_group_info(update, context) # Fetch the group data
+        if not group_data:
             print("Failed to fetch group info. No action taken.")
             return
 
-        group_data, group_doc = result  # Unpack the tuple
-
         validation_result = validate_media(update)
 
         if not validation_result['valid']:
@@ -1962,11 +1876,10 @@ def handle_buybot_message_image(update: Update, context: CallbackContext) -> Non
         print(f"Buybot header URL: {buybot_header_url}")
 
         if group_data is not None:
-            group_doc.update({
+            repository.groups.update(update.effective_chat.id, {
                 'premium_features.buybot_header': True,
                 'premium_features.buybot_header_url': buybot_header_url
             })
-            utils.clear_group_cache(str(update.effective_chat.id))  # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2036,21 +1949,18 @@ def validate_media(update, max_width=700, max_height=250, max_size=1000000):
 #region Sypher Trust Setup
 def enable_sypher_trust(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if not is_premium_group(update, context): return
 
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'premium_features.sypher_trust': True,
             'premium_features.sypher_trust_preferences': 'moderate'
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2065,20 +1975,17 @@ def enable_sypher_trust(update: Update, context: CallbackContext) -> None:
 
 def disable_sypher_trust(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-    
     if not is_premium_group(update, context): return
 
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'premium_features.sypher_trust': False
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2129,18 +2036,15 @@ def sypher_trust_preferences(update: Update, context: CallbackContext) -> None:
 
 def sypher_trust_relaxed(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'premium_features.sypher_trust_preferences': 'relaxed'
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2154,18 +2058,15 @@ def sypher_trust_relaxed(update: Update, context: CallbackContext) -> None:
 
 def sypher_trust_moderate(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'premium_features.sypher_trust_preferences': 'moderate'
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2179,18 +2080,15 @@ def sypher_trust_moderate(update: Update, context: CallbackContext) -> None:
 
 def sypher_trust_strict(update: Update, context: CallbackContext) -> None:
     msg = None
-    result = utils.fetch_group_info(update, context, return_both=True) # Fetch both group_data and group_doc
-    if not result:
+    group_data = utils.fetch_group_info(update, context) # Fetch the group data
+    if not group_data:
         print("Failed to fetch group info. No action taken.")
         return
 
-    group_data, group_doc = result  # Unpack the tuple
-
     if group_data is not None:
-        group_doc.update({
+        repository.groups.update(update.effective_chat.id, {
             'premium_features.sypher_trust_preferences': 'strict'
         })
-        utils.clear_group_cache(str(update.effective_chat.id)) # Clear the cache on all database updates
 
         msg = context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -2217,6 +2115,7 @@ def setup_buybot(update: Update, context: CallbackContext) -> None:
             InlineKeyboardButton("Small Buy", callback_data='setup_small_buy'),
             InlineKeyboardButton("Medium Buy", callback_data='setup_medium_buy'),
         ],
+        [InlineKeyboardButton("Digest Buy", callback_data='setup_digest_buy')],
         [InlineKeyboardButton("Back", callback_data='setup_premium')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -2234,7 +2133,9 @@ def setup_buybot(update: Update, context: CallbackContext) -> None:
         '🐬 *Medium Buy* 🐬\n'
         'Below this amount will be considered a medium buy.\n\n'
         '🐳 *Whale* 🐳\n'
-        'Any buy above the medium buy amount will be considered a whale.',
+        'Any buy above the medium buy amount will be considered a whale.\n\n'
+        '*Digest Buy:*\n'
+        'When several buys land at once, the ones below this amount are combined into one message. Defaults to the medium buy amount, 0 sends every buy on its own.',
         parse_mode='Markdown',
         reply_markup=reply_markup
     )
@@ -2278,12 +2179,10 @@ def handle_minimum_buy(update: Update, context: CallbackContext) -> None:
             group_id = update.effective_chat.id
             group_data = utils.fetch_group_info(update, context)
             if group_data is not None:
-                group_doc = firebase.DATABASE.collection('groups').document(str(group_id))
-                group_doc.update({
+                repository.groups.update(group_id, {
                     'premium_features.buybot.minimumbuy': int(update.message.text)
                 })
                 msg = update.message.reply_text("Minimum buy value updated successfully!")
-                utils.clear_group_cache(str(group_id)) # Clear the cache on all database updates
 
         store_setup_message(context, msg.message_id)
 
@@ -2327,12 +2226,10 @@ def handle_small_buy(update: Update, context: CallbackContext) -> None:
             group_id = update.effective_chat.id
             group_data = utils.fetch_group_info(update, context)
             if group_data is not None:
-                group_doc = firebase.DATABASE.collection('groups').document(str(group_id))
                 try:
-                    group_doc.update({
+                    repository.groups.update(group_id, {
                         'premium_features.buybot.smallbuy': int(update.message.text)
                     })
-                    utils.clear_group_cache(str(group_id))  # Clear the cache on all database updates
                     msg = update.message.reply_text("Small buy value updated successfully!")
                 except Exception as e:
                     msg = update.message.reply_text(f"Error updating small buy value: {e}")
@@ -2380,12 +2277,10 @@ def handle_medium_buy(update: Update, context: CallbackContext) -> None:
             group_id = update.effective_chat.id
             group_data = utils.fetch_group_info(update, context)
             if group_data is not None:
-                group_doc = firebase.DATABASE.collection('groups').document(str(group_id))
                 try:
-                    group_doc.update({
+                    repository.groups.update(group_id, {
                         'premium_features.buybot.mediumbuy': int(update.message.text)
                     })
-                    utils.clear_group_cache(str(group_id))  # Clear the cache on all database updates
                     msg = update.message.reply_text("Medium buy value updated successfully!")
                 except Exception as e:
                     msg = update.message.reply_text(f"Error updating medium buy value: {e}")
@@ -2398,6 +2293,57 @@ def handle_medium_buy(update: Update, context: CallbackContext) -> None:
 
     if msg is not None:
         utils.track_message(msg)
+
+def setup_digest_buy_callback(update: Update, context: CallbackContext) -> None:
+    msg = None
+    query, user_id = utils.get_query_info(update)
+
+    if utils.is_user_owner(update, context, user_id):
+
+        keyboard = [
+            [InlineKeyboardButton("Back", callback_data='setup_buybot')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        menu_change(context, update) 
+
+        msg = context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text='Please respond with the amount below which buys that land together are combined into one digest message. Send 0 to always alert every buy.',
+            reply_markup=reply_markup
+        )
+        context.chat_data['setup_stage'] = 'digest_buy'
+        print("Requesting digest buy amount.")
+        store_setup_message(context, msg.message_id)
+
+        if msg is not None:
+            utils.track_message(msg)
+
+def handle_digest_buy(update: Update, context: CallbackContext) -> None:
+    msg = None
+    user_id = update.message.from_user.id
+    
+    if utils.is_user_owner(update, context, user_id):
+        if context.chat_data.get('setup_stage') == 'digest_buy':
+            group_id = update.effective_chat.id
+            group_data = utils.fetch_group_info(update, context)
+            if group_data is not None:
+                try:
+                    repository.groups.update(group_id, {
+                        'premium_features.buybot.digestbuy': int(update.message.text)
+                    })
+                    msg = update.message.reply_text("Digest buy value updated successfully!")
+                except Exception as e:
+                    msg = update.message.reply_text(f"Error updating digest buy value: {e}")
+        
+        if msg:
+            store_setup_message(context, msg.message_id)
+
+    else:
+        print("User is not the owner.")
+
+    if msg is not None:
+        utils.track_message(msg)
 #endregion Buybot Setup
 ##
 #
@@ -1,15 +1,13 @@
 import sys
-import time
 import requests
 from telegram import Bot, Update, Chat
 from telegram.ext import CallbackContext
 from cachetools import TTLCache
 
-from firebase_admin import firestore
 from datetime import datetime, timedelta, timezone
 
 # Import the necessary modules from the modules folder
-from modules import config, firebase
+from modules import config, firebase, cache, repository, ratelimit
 
 bot = Bot(token=config.TELEGRAM_TOKEN)
 
@@ -120,8 +118,7 @@ def is_user_trusted(update: Update, context: CallbackContext) -> None:
         print(f"Sypher Trust is not enabled for group {group_id}. Allowing user {user_id}.")
         return True
 
-    untrusted_users = group_data.get('untrusted_users', {}) # Check if the user is in untrusted_users
-    user_data = untrusted_users.get(user_id)
+    user_data = repository.groups.get_member(group_id, 'untrusted_users', user_id) # Check if the user is in untrusted_users
     if not user_data:
         print(f"User {user_id} is not in untrusted_users for group {group_id}. Assuming trusted.")
         return True
@@ -149,8 +146,7 @@ def is_user_trusted(update: Update, context: CallbackContext) -> None:
 
     if time_elapsed >= trust_duration: # Check if sufficient time has passed
         print(f"User {user_id} has been in untrusted_users for {time_elapsed}. Removing from untrusted_users.")
-        firebase.DATABASE.collection('groups').document(group_id).update({f'untrusted_users.{user_id}': firestore.DELETE_FIELD})
-        clear_group_cache(group_id) # Clear the cache on all database updates
+        repository.groups.delete_member(group_id, 'untrusted_users', user_id)
         return True
     else:
         print(f"User {user_id} has been in untrusted_users for {time_elapsed}. Still untrusted.")
@@ -236,6 +232,7 @@ def fetch_group_dictionary(update: Update, context: CallbackContext, general: bo
     Returns a modular dictionary structure with improved clarity and relevance.
     If `general` is True, returns only general group information.
     """
+    group_id = str(update.effective_chat.id)
     group_data = fetch_group_info(update, context)
     if not group_data:
         print("No group data found. Returning default values.")
@@ -299,9 +296,9 @@ def fetch_group_dictionary(update: Update, context: CallbackContext, general: bo
             "setup_complete": group_data.get("token", {}).get("setup_complete", False),
             "total_supply": group_data.get("token", {}).get("total_supply", 0),
         },
-        "untrusted_users": group_data.get("untrusted_users", {}),
-        "unverified_users": group_data.get("unverified_users", {}),
-        "warnings": group_data.get("warnings", {}),
+        "untrusted_users": repository.groups.list_members(group_id, "untrusted_users", group_data),
+        "unverified_users": repository.groups.list_members(group_id, "unverified_users", group_data),
+        "warnings": repository.groups.list_members(group_id, "warnings", group_data),
     }
 
     print(f"Fetched and processed detailed dictionary for group {group_data.get('group_id', 'Unknown Group ID')}: {detailed_info}")
@@ -331,13 +328,10 @@ def fetch_command_status(update: Update, context: CallbackContext, command: str)
 #
 ##
 #region Caching
-group_info_cache = {}
+group_info_cache = cache.group_cache # Bounded, TTL-aware and refreshed by Firestore snapshot listeners on the busiest groups
 def cache_group_info(group_id: str, group_data: dict, group_doc: object) -> None: # Caches the group data and document reference for a specific group ID.
     group_id = str(group_id)
-    group_info_cache[group_id] = {
-        "group_data": group_data,
-        "group_doc": group_doc
-    }
+    group_info_cache.set(group_id, group_data, group_doc)
 
     print(f"Cached info for group {group_id}.")
 
@@ -354,8 +348,7 @@ def fetch_cached_group_info(group_id: str) -> dict | None: # Retrieves cached gr
 
 def clear_group_cache(group_id: str) -> None: # Clears the cache for a specific group ID.
     group_id = str(group_id)
-    if group_id in group_info_cache:
-        del group_info_cache[group_id]
+    if group_info_cache.delete(group_id):
         print(f"Cache cleared for group {group_id}.")
     else:
         print(f"No cache entry found for group {group_id}.")
@@ -391,45 +384,9 @@ def get_username(update: Update) -> str:
 #
 ##
 #region Rate Limiting
-group_rate_limits = {}  # Store rate limits for each group
-last_check_time = time.time()
-command_count = 0
-def rate_limit_check(chat_id: str) -> bool: # Later TODO: Implement rate limiting PER GROUP
+def rate_limit_check(chat_id: str, command: str = None) -> bool: # Token buckets bot-wide and per group, see ratelimit.COMMAND_COSTS for per-command costs
     print("Checking rate limit...")
-    global last_check_time, command_count
-    global group_rate_limits
-
-    current_time = time.time()
-
-    if current_time - last_check_time > config.BOT_RATE_LIMIT_TIME_PERIOD: # Check and update bot-wide rate limit
-        command_count = 0
-        last_check_time = current_time
-
-    if command_count >= config.BOT_RATE_LIMIT_MESSAGE_COUNT:
-        print("Bot-wide rate limit exceeded.")
-        return False
-
-    if chat_id not in group_rate_limits: # Check and update group-specific rate limit
-        group_rate_limits[chat_id] = {
-            "last_check_time": 0,
-            "command_count": 0
-        }
-
-    group_data = group_rate_limits[chat_id]
-
-    if current_time - group_data["last_check_time"] > config.GROUP_RATE_LIMIT_TIME_PERIOD:
-        group_data["command_count"] = 0
-        group_data["last_check_time"] = current_time
-
-    if group_data["command_count"] >= config.GROUP_RATE_LIMIT_MESSAGE_COUNT:
-        print(f"Group {chat_id} rate limit exceeded.")
-        return False
-
-    # Increment counters if within limits
-    command_count += 1
-    group_data["command_count"] += 1
-
-    return True
+    return ratelimit.limiter.allow(chat_id, command)
 #endregion Rate Limiting
 ##
 #